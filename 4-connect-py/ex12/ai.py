@@ -1,37 +1,818 @@
-import numpy as np
-import random
-
-EMPTY_CELL = '_'
-NUM_OF_COLUMNS = 7
-
-class AI:
-    """
-    This class represents the artificial intelligence. It can play
-    against another artificial intelligence or a human. It will place a
-    disk randomly.
-    :param game: Game object
-    :param player: current player (1/2)
-    """
-
-    def __init__(self, game, player):
-        self.game = game
-        self.player = player
-
-    def find_legal_move(self):
-        """
-        This function will create a list in which it will add the number of
-        each column that has yet to be filled. From that list, a random
-        valid column will be returned.
-        :return: the number of a column the disk can be placed in.
-        """
-        possible_moves = []
-        transposed_game = np.transpose(self.game.board.board)
-        for i in range(NUM_OF_COLUMNS):
-            if EMPTY_CELL in list(transposed_game)[i]:
-                possible_moves.append(i)
-        if possible_moves == []:
-            raise Exception('No possible AI moves')
-        return random.choice(possible_moves)
-
-    def get_last_found_move(self):
-        pass
+import random
+import threading
+import time
+
+from . import metrics
+from .game import Game
+from .solved import from_score, to_score
+
+DEFAULT_DEPTH = 8
+# with a solved position database, positions with this many empty places
+# or fewer are searched to the end of the game
+ENDGAME_CELLS = 14
+DEFAULT_TABLE_SIZE = 1 << 18
+# the number of bitboards whose winning places are remembered (see
+# AI._winning_places)
+THREAT_CACHE_SIZE = 1 << 16
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# how many nodes to search between looking at the clock
+CLOCK_CHECK_NODES = 1024
+# how often a search split over processes checks if it was stopped
+STOP_CHECK_SECONDS = 0.05
+
+
+def decided(score):
+    """
+    :return: True if the score is the one of a win or a loss, and not a draw
+    or a heuristic score
+    """
+    return score >= 1 or score <= -1
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time given to it is over.
+    """
+
+
+class SearchClock:
+    """
+    The deadline and the stop signal of one search. Every search gets its
+    own, so a search that was stopped stays stopped when the next one
+    starts.
+    """
+
+    def __init__(self):
+        self.deadline = None
+        self.stopped = False
+
+    def stop(self):
+        """
+        Makes the search end the next time it looks at the clock.
+        :return: None
+        """
+        self.stopped = True
+
+    def over(self):
+        """
+        :return: True if the search was stopped or its time is over
+        """
+        return self.stopped or (self.deadline is not None
+                                and time.perf_counter() > self.deadline)
+
+
+class TranspositionTable:
+    """
+    A fixed size table of searched positions. Every key has a single slot
+    (key % size), and when two positions fight over a slot the entry that
+    was searched deeper is kept, unless it was left over from an older
+    search, in which case it is replaced.
+    :param size: the number of slots in the table
+    """
+
+    def __init__(self, size=DEFAULT_TABLE_SIZE):
+        self.size = size
+        self.slots = [None] * size
+        self.generation = 0
+        self.entries = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        """
+        Marks the entries stored until now as old, so they are the first to
+        be replaced, and starts counting probes again.
+        :return: None
+        """
+        self.generation += 1
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, key):
+        """
+        :return: the (depth, flag, score, move) saved for the key, or None if
+        the key is not in the table.
+        """
+        self.probes += 1
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1:5]
+        return None
+
+    def put(self, key, depth, flag, score, move):
+        """
+        Saves a searched position, following the replacement policy.
+        :return: None
+        """
+        index = key % self.size
+        entry = self.slots[index]
+        if entry is None:
+            self.entries += 1
+        elif entry[0] != key and entry[1] > depth \
+                and entry[5] == self.generation:
+            return
+        self.slots[index] = (key, depth, flag, score, move, self.generation)
+
+    def hit_rate(self):
+        """
+        :return: the share of probes that found their position
+        """
+        return self.hits / self.probes if self.probes else 0.0
+
+
+class AI:
+    """
+    This class represents the artificial intelligence. It can play
+    against another artificial intelligence or a human. It searches the
+    game tree with negamax and alpha-beta pruning, remembering positions it
+    has already searched in a transposition table.
+    :param game: Game object
+    :param player: current player (1/2)
+    :param depth: how many moves ahead to search
+    :param table_size: the number of slots in the transposition table
+    :param cache: a PositionCache shared with other players, where the
+    result of every search is saved and looked up before searching
+    :param book: an OpeningBook to take the moves of the positions it has
+    from, without searching
+    :param solved: a SolvedDatabase to take the moves of solved positions
+    from, and to save the positions the search solves in
+    :param endgame_cells: with a solved database, the number of empty
+    places from which positions are searched to the end of the game
+    :param workers: the number of processes to split the search over (see
+    _split_search), 1 searches in this process
+    :param evaluation: True to score the positions at the end of the search
+    with the heuristic of ex12.evaluate instead of as 0 (a draw)
+    :param forced_moves: False to search the positions where a move is
+    forced too (see _forced_move), for a caller that needs their score
+    """
+
+    def __init__(self, game, player, depth=DEFAULT_DEPTH,
+                 table_size=DEFAULT_TABLE_SIZE, cache=None, book=None,
+                 solved=None, endgame_cells=ENDGAME_CELLS, workers=1,
+                 evaluation=False, forced_moves=True):
+        self.game = game
+        self.player = player
+        self.depth = depth
+        self.forced_moves = forced_moves
+        self.workers = workers
+        self.pool = None
+        self.evaluation = evaluation
+        self.evaluator = None
+        if evaluation:
+            from .evaluate import Evaluator
+            self.evaluator = Evaluator.get(game.geometry)
+        self.stopping = None
+        self.table = TranspositionTable(table_size)
+        self.cache = cache
+        geometry = game.geometry
+        size = (geometry.width, geometry.height, geometry.disks_to_win)
+        if book is not None \
+                and (book.width, book.height, book.disks_to_win) != size:
+            raise Exception('The opening book is for another board size')
+        if solved is not None \
+                and (solved.width, solved.height, solved.disks_to_win) != size:
+            raise Exception('The solved positions are for another board size')
+        self.book = book
+        self.solved = solved
+        self.endgame_cells = endgame_cells
+        self.last_found_move = None
+        self.last_score = None
+        self.nodes = 0
+        # the node count at which the clock is looked at next
+        self.next_check = CLOCK_CHECK_NODES
+        self.search_time = 0.0
+        self.completed_depth = 0
+        # the clock of the current (or last) search, the one stop stops
+        self.search = None
+        # the results of pondering, by the key of the position after each
+        # reply of the other player (see ponder)
+        self.pondered = {}
+        self.ponder_thread = None
+
+        self.cells = geometry.cells
+        self.bottom = geometry.bottom
+        self.top = geometry.top
+        self.cell_lines = geometry.cell_lines
+        self.threat_cache = {}
+        # center columns first, they take part in the most lines
+        self.order = sorted(range(geometry.width), key=lambda column:
+                            abs(2 * column - geometry.width + 1))
+
+    def _negamax(self, current, mask, moves, depth, alpha, beta, search,
+                 wins=None):
+        """
+        This function will score the position for the player to move. A win
+        is worth more the sooner it comes, a loss the other way around, and
+        anything not decided within depth moves is worth 0, or, with an
+        evaluator, its heuristic score, which is between -1 and 1. The
+        positions at the end of the search are scored all at once, from the
+        position before them.
+        :param current: the bitboard of the player to move
+        :param mask: the bitboard of all the disks
+        :param moves: the number of disks on the board
+        :param depth: how many more moves to search
+        :param alpha: the score the player to move is already sure of
+        :param beta: the score the opponent is already sure of
+        :param search: the SearchClock of the search, looked at every
+        CLOCK_CHECK_NODES positions
+        :param wins: the places that would win for the player to move, if
+        they are known already (see Geometry.winning_places)
+        :return: the score of the position and the best column found
+        """
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            # the count can jump by more than one (leaves scored at once),
+            # so it is compared and not divided
+            self.next_check = self.nodes + CLOCK_CHECK_NODES
+            if search.over():
+                raise SearchTimeout()
+        if moves == self.cells:
+            return 0, None
+
+        playable = [column for column in self.order
+                    if not mask & self.top[column]]
+        moves_to = [(column, (mask + self.bottom[column]) & ~mask)
+                    for column in playable]
+        if wins is None:
+            wins = self._winning_places(current)
+        for column, move in moves_to:
+            if move & wins:
+                return (self.cells + 1 - moves) // 2, column
+
+        if depth == 0:
+            if self.evaluator is not None:
+                return self.evaluator.evaluate_bitboards([current],
+                                                         [mask])[0], None
+            return 0, None
+
+        # a place the opponent would win in next has to be blocked, and a
+        # disk right below such a place lets the opponent win on top of it
+        opponent = current ^ mask
+        threats = self._winning_places(opponent)
+        blocks = []
+        safe = []
+        for column, move in moves_to:
+            if move & threats:
+                blocks.append(column)
+            elif not move << 1 & threats:
+                safe.append(column)
+        if len(blocks) > 1 or not blocks and not safe:
+            # whatever is played, the opponent wins with its next disk
+            return -((self.cells - moves) // 2), (blocks or playable)[0]
+        playable = blocks or safe
+
+        key = current + mask
+        best_move = None
+        entry = self.table.get(key)
+        if entry is not None:
+            entry_depth, flag, score, best_move = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return score, best_move
+                if flag == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                elif flag == UPPER_BOUND:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score, best_move
+        if moves == self.root_moves and self.last_found_move in playable:
+            # the best move of the last finished iteration goes first
+            best_move = self.last_found_move
+        if best_move in playable:
+            playable.remove(best_move)
+            playable.insert(0, best_move)
+
+        original_alpha = alpha
+        best_score = -self.cells
+        leaf_scores = None
+        if depth == 1 and self.evaluator is not None:
+            children = [mask | (mask + self.bottom[column])
+                        for column in playable]
+            leaf_scores = self.evaluator.evaluate_bitboards(
+                [opponent] * len(children), children)
+            self.nodes += len(children)
+        for index, column in enumerate(playable):
+            if leaf_scores is not None:
+                score = -leaf_scores[index]
+            else:
+                score = -self._negamax(opponent,
+                                       mask | (mask + self.bottom[column]),
+                                       moves + 1, depth - 1, -beta,
+                                       -alpha, search, threats)[0]
+            if score > best_score:
+                best_score, best_move = score, column
+                if moves == self.root_moves and not self.completed_depth:
+                    self.last_found_move = column
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.table.put(key, depth, flag, best_score, best_move)
+        return best_score, best_move
+
+    def _winning_places(self, bitboard):
+        """
+        A player's disks come back in many positions of a search, so the
+        places they would win in are remembered. Only the bitboard is part
+        of the key, so some of the places may be taken already.
+        :param bitboard: the disks of a player
+        :return: the places that would complete a line of the player
+        """
+        places = self.threat_cache.get(bitboard)
+        if places is None:
+            if len(self.threat_cache) >= THREAT_CACHE_SIZE:
+                self.threat_cache.clear()
+            places = self.threat_cache[bitboard] = \
+                self.game.geometry.winning_places(bitboard, 0)
+        return places
+
+    @metrics.timed('ai.find_legal_move')
+    def find_legal_move(self, timeout=None, search=None):
+        """
+        This function will search the current position of the game and
+        return the best column it found for the player whose turn it is.
+        A column that wins, or that blocks the other player from winning
+        with its next disk, is played without searching (unless
+        self.forced_moves is False).
+        Without a timeout the search goes self.depth moves ahead. With a
+        timeout, the search is repeated one move deeper each time until the
+        time is over or the game is solved, and the best column of the
+        deepest search that was finished is returned.
+        The score of the column (for the player to move, 0 if the search
+        didn't see the game end) is left in self.last_score.
+        :param timeout: the number of seconds the search may take, or None
+        :param search: the SearchClock to stop the search with, for a caller
+        on another thread that may stop it before it started; a new one is
+        made if it is None
+        :return: the number of a column the disk can be placed in.
+        """
+        self.stop_pondering()
+        if search is None:
+            search = SearchClock()
+        self.search = search
+        board = self.game.board
+        if board.is_full():
+            raise Exception('No possible AI moves')
+        current = board.bitboards[self.game.current_player - 1]
+        self.root_moves = self.game.moves_played
+        self.last_found_move = None
+        self.last_score = None
+        self.completed_depth = 0
+        self.nodes = 0
+        self.next_check = CLOCK_CHECK_NODES
+        self.table.new_search()
+        start = time.perf_counter()
+        if self.forced_moves and self._forced_move():
+            self.search_time = time.perf_counter() - start
+            if metrics.ENABLED:
+                metrics.count('ai.forced_moves')
+            return self.last_found_move
+        if self.book is not None:
+            entry = self.book.lookup(board)
+            if entry is not None:
+                self.last_score, self.last_found_move = entry
+                self.search_time = time.perf_counter() - start
+                if metrics.ENABLED:
+                    metrics.count('ai.book_moves')
+                return self.last_found_move
+        empty = self.cells - self.root_moves
+        if self.solved is not None:
+            entry = self.solved.lookup(board)
+            if entry is not None:
+                result, distance, self.last_found_move = entry
+                self.last_score = to_score(result, distance, self.root_moves,
+                                           self.cells)
+                self.search_time = time.perf_counter() - start
+                if metrics.ENABLED:
+                    metrics.count('ai.solved_moves')
+                return self.last_found_move
+        entry = self._pondered_entry(current)
+        if entry is not None:
+            depth, score, move, seconds = entry
+            if depth and (decided(score)
+                          or (depth >= self.depth if timeout is None
+                              else seconds >= timeout)):
+                self.last_found_move = move
+                self.last_score = score
+                self.completed_depth = depth
+                self.search_time = time.perf_counter() - start
+                if metrics.ENABLED:
+                    metrics.count('ai.pondered_moves')
+                return self.last_found_move
+            if timeout is not None:
+                timeout -= seconds  # the position was searched for already
+        if timeout is None:
+            if self.solved is not None and empty <= self.endgame_cells:
+                depths = [empty]  # solve it, so it can be saved
+            else:
+                depths = [self.depth]
+        else:
+            search.deadline = start + timeout
+            depths = range(1, empty + 1)
+        if self._cached_move(depths[-1]):
+            self.search_time = time.perf_counter() - start
+            if metrics.ENABLED:
+                metrics.count('ai.cached_moves')
+            return self.last_found_move
+        try:
+            for depth in depths:
+                if self.workers > 1:
+                    score, move = self._split_search(current, board.mask,
+                                                     depth, search)
+                else:
+                    score, move = self._negamax(current, board.mask,
+                                                self.root_moves, depth,
+                                                -self.cells, self.cells,
+                                                search)
+                self.last_found_move = move
+                self.last_score = score
+                self.completed_depth = depth
+                if decided(score):
+                    break  # the game is decided, going deeper won't help
+        except SearchTimeout:
+            pass
+        finally:
+            self.search_time = time.perf_counter() - start
+        if metrics.ENABLED:
+            metrics.observe('ai.nodes', self.nodes)
+            metrics.observe('ai.depth', self.completed_depth)
+            metrics.observe_seconds('ai.search_seconds', self.search_time)
+        if self.solved is not None and self.completed_depth \
+                and (decided(self.last_score)
+                     or self.completed_depth >= empty):
+            # the game ends within the search, so the score is exact
+            result, distance = from_score(self.last_score, self.root_moves,
+                                          self.cells)
+            self.solved.save(board, result, distance, self.last_found_move)
+        if self.cache is not None and self.completed_depth:
+            move = self.last_found_move
+            if board.is_mirrored():
+                move = board.width - 1 - move
+            self.cache.put(board.canonical_key(), self.completed_depth,
+                           (self.last_score, move))
+        if self.last_found_move is None:
+            self.last_found_move = next(
+                column for column in self.order
+                if not board.mask & self.top[column])
+        return self.last_found_move
+
+    def _forced_move(self):
+        """
+        This function will check, without searching, whether the player to
+        move can win right away or has to block the other player from
+        winning with its next disk. If so, the column is left in
+        self.last_found_move and its score in self.last_score (0 for a
+        block, unless there are two places to block and the game is lost).
+        :return: True if the move is forced, False otherwise
+        """
+        player = self.game.current_player
+        wins = self.game.winning_columns(player)
+        if wins:
+            self.last_found_move = wins[0]
+            self.last_score = (self.cells + 1 - self.root_moves) // 2
+            return True
+        blocks = self.game.winning_columns(player % 2 + 1)
+        if not blocks:
+            return False
+        self.last_found_move = blocks[0]
+        self.last_score = 0 if len(blocks) == 1 \
+            else -((self.cells - self.root_moves) // 2)
+        return True
+
+    def _split_search(self, current, mask, depth, search):
+        """
+        This function will search the root position over the worker
+        processes. The first column (the best one of the last iteration) is
+        searched here, and then all the other columns at the same time, one
+        per worker, each only needing to show whether it beats the first
+        one. The score and the column are the ones _negamax would find.
+        Each worker keeps its own transposition table between searches.
+        :param search: the SearchClock of the search
+        :return: the score of the position and the best column
+        """
+        playable = [column for column in self.order
+                    if not mask & self.top[column]]
+        for column in playable:
+            move = (mask + self.bottom[column]) & ~mask
+            placed = current | move
+            for line in self.cell_lines[move]:
+                if placed & line == line:
+                    return (self.cells + 1 - self.root_moves) // 2, column
+        if self.last_found_move in playable:
+            # the best column of the last iteration goes first
+            playable.remove(self.last_found_move)
+            playable.insert(0, self.last_found_move)
+        first = playable.pop(0)
+        alpha = -self._negamax(current ^ mask,
+                               mask | (mask + self.bottom[first]),
+                               self.root_moves + 1, depth - 1,
+                               -self.cells, self.cells, search)[0]
+        if not playable:
+            return alpha, first
+        # only a split search needs processes, so they are not imported
+        # when the game starts
+        import multiprocessing
+        from concurrent.futures import (FIRST_COMPLETED,
+                                        ProcessPoolExecutor, wait)
+        if self.pool is None:
+            self.stopping = multiprocessing.RawValue('b', 0)
+            self.pool = ProcessPoolExecutor(
+                self.workers, initializer=start_worker,
+                initargs=(self.stopping,))
+        self.stopping.value = 0
+        geometry = self.game.geometry
+        size = (geometry.width, geometry.height, geometry.disks_to_win)
+        seconds = None if search.deadline is None \
+            else search.deadline - time.perf_counter()
+        futures = {self.pool.submit(
+            search_position, size, current ^ mask,
+            mask | (mask + self.bottom[column]), self.root_moves + 1,
+            depth - 1, -self.cells, -alpha, self.evaluation, seconds):
+            column for column in playable}
+        pending = set(futures)
+        try:
+            while pending:
+                _, pending = wait(pending, STOP_CHECK_SECONDS,
+                                  FIRST_COMPLETED)
+                if search.over():
+                    raise SearchTimeout()
+        finally:
+            for future in pending:
+                future.cancel()
+        best_score, best_move = alpha, first
+        for future, column in futures.items():
+            score, nodes = future.result()
+            self.nodes += nodes
+            if score is None:
+                raise SearchTimeout()
+            # a score above alpha is exact, one below only a bound
+            if -score > best_score:
+                best_score, best_move = -score, column
+        return best_score, best_move
+
+    def ponder(self):
+        """
+        This function will start searching, on a thread, the positions the
+        other player's possible moves lead to, while it is the other
+        player's turn, until stop_pondering is called. The reply searched
+        for the shortest time so far is always the next to be searched one
+        move deeper, so the time is shared evenly between the replies. The
+        searches fill the transposition table. find_legal_move plays the
+        move found for the reply that was made if it was searched as long as
+        a move may take, and otherwise only searches for the rest of the
+        time.
+        A search that was started before has to have ended first, as
+        pondering uses the same table (see stop).
+        :return: None
+        """
+        if self.game.current_player == self.player:
+            raise Exception('Pondering is done on the other player\'s turn')
+        self.stop_pondering()
+        board = self.game.board
+        current = board.bitboards[self.player - 1]
+        opponent = current ^ board.mask
+        moves = self.game.moves_played + 1
+        replies = []
+        for column in self.game.geometry.moves(board.mask):
+            move = (board.mask + self.bottom[column]) & ~board.mask
+            if moves < self.cells \
+                    and not self.game.geometry.wins(opponent | move, move):
+                replies.append(board.mask | move)
+        self.pondered = {}
+        self.search = SearchClock()
+        self.ponder_thread = threading.Thread(
+            target=self._ponder, args=(current, replies, moves, self.search),
+            daemon=True)
+        self.ponder_thread.start()
+
+    def _ponder(self, current, replies, moves, search):
+        """
+        This function will search the positions after the replies until
+        the search is stopped (see ponder).
+        :param current: the bitboard of this player
+        :param replies: the bitboards of all the disks after every reply
+        :param moves: the number of disks on the board after a reply
+        :param search: the SearchClock of the pondering
+        :return: None
+        """
+        self.root_moves = moves
+        self.table.new_search()
+        for mask in replies:
+            self.pondered[current + mask] = (0, 0, None, 0.0)
+        try:
+            while not search.over():
+                # before any was searched, the ones that are the worst for
+                # this player go first
+                left = []
+                for mask in replies:
+                    depth, score, _, seconds = self.pondered[current + mask]
+                    if not decided(score) and depth < self.cells - moves:
+                        left.append((seconds, score, mask))
+                if not left:
+                    return
+                mask = min(left)[2]
+                key = current + mask
+                depth, score, move, seconds = self.pondered[key]
+                self.last_found_move = move
+                self.completed_depth = depth
+                start = time.perf_counter()
+                try:
+                    score, move = self._negamax(current, mask, moves,
+                                                depth + 1, -self.cells,
+                                                self.cells, search)
+                    depth += 1
+                finally:
+                    seconds += time.perf_counter() - start
+                    self.pondered[key] = (depth, score, move, seconds)
+        except SearchTimeout:
+            pass
+
+    def stop_pondering(self):
+        """
+        This function will stop pondering, if it was started, and wait for
+        the search to end.
+        :return: None
+        """
+        if self.ponder_thread is None:
+            return
+        self.stop()
+        self.ponder_thread.join()
+        self.ponder_thread = None
+
+    def _pondered_entry(self, current):
+        """
+        This function will look up what pondering found for the current
+        position. The results for the other replies are thrown away.
+        :return: the depth of the deepest finished search (0 if none was),
+        its score and column, and the seconds spent searching the position,
+        or None if it was not pondered
+        """
+        pondered, self.pondered = self.pondered, {}
+        return pondered.get(current + self.game.board.mask)
+
+    def _cached_move(self, depth):
+        """
+        This function will look the position up in the shared cache, and
+        take its move if it was searched at least depth moves ahead or is
+        already decided.
+        :return: True if the move was taken from the cache
+        """
+        if self.cache is None:
+            return False
+        board = self.game.board
+        entry = self.cache.get(board.canonical_key())
+        if entry is None:
+            return False
+        entry_depth, (score, move) = entry
+        if entry_depth < depth and not decided(score):
+            return False
+        if board.is_mirrored():
+            move = board.width - 1 - move
+        self.last_found_move = move
+        self.last_score = score
+        self.completed_depth = entry_depth
+        return True
+
+    def stop(self):
+        """
+        Makes a running search end the next time it looks at the clock. The
+        search still returns the best column it has found. The search is
+        only asked to end, a thread running it should be joined before the
+        AI is used again. A search that might not have started yet is
+        stopped with the SearchClock it was given instead.
+        :return: None
+        """
+        if self.search is not None:
+            self.search.stop()
+        if self.stopping is not None:
+            self.stopping.value = 1
+
+    def close(self):
+        """
+        Stops the worker processes.
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+            self.stopping = None
+
+    def get_last_found_move(self):
+        """
+        :return: the best column of the deepest finished iteration of the
+        current (or last) search, the best column found so far if no
+        iteration has finished, or None if nothing was found yet.
+        """
+        return self.last_found_move
+
+    def report(self):
+        """
+        :return: a dictionary with the statistics of the last search
+        """
+        return {
+            'nodes': self.nodes,
+            'depth': self.completed_depth,
+            'seconds': self.search_time,
+            'nodes_per_second': self.nodes / self.search_time
+            if self.search_time else 0.0,
+            'workers': self.workers,
+            'table_hit_rate': self.table.hit_rate(),
+            'table_entries': self.table.entries,
+            'table_size': self.table.size,
+        }
+
+
+# the AI each worker process searches with, by board size
+_worker_ais = {}
+
+
+def start_worker(stopping):
+    """
+    Starts a thread in a worker process that stops its searches while the
+    main process has the stopping flag set.
+    :return: None
+    """
+    def stop_searches():
+        while True:
+            if stopping.value:
+                for ai in list(_worker_ais.values()):
+                    ai.stop()
+            time.sleep(STOP_CHECK_SECONDS)
+
+    threading.Thread(target=stop_searches, daemon=True).start()
+
+
+def search_position(size, current, mask, moves, depth, alpha, beta,
+                    evaluation, seconds):
+    """
+    This function will search a position in a worker process for
+    AI._split_search.
+    :param size: the (width, height, disks_to_win) of the board
+    :param seconds: the time the search may take, or None
+    :return: the score for the player to move (None if the time was over)
+    and the number of nodes searched
+    """
+    ai = _worker_ais.get((size, evaluation))
+    if ai is None:
+        ai = _worker_ais[size, evaluation] = AI(Game(*size), Game.PLAYER_1,
+                                                evaluation=evaluation)
+    ai.root_moves = -1  # no position is the root, it is in the main process
+    ai.completed_depth = depth
+    ai.nodes = 0
+    ai.next_check = CLOCK_CHECK_NODES
+    ai.table.new_search()
+    search = ai.search = SearchClock()
+    if seconds is not None:
+        search.deadline = time.perf_counter() + seconds
+    try:
+        score = ai._negamax(current, mask, moves, depth, alpha, beta,
+                            search)[0]
+    except SearchTimeout:
+        score = None
+    return score, ai.nodes
+
+
+class RandomAI:
+    """
+    A player that places its disk in a random column that is not full.
+    :param game: Game object
+    :param player: current player (1/2)
+    :param seed: seed for the random choices
+    """
+
+    def __init__(self, game, player, seed=None):
+        self.game = game
+        self.player = player
+        self.random = random.Random(seed)
+        self.last_found_move = None
+
+    def find_legal_move(self, timeout=None, search=None):
+        """
+        :param timeout: not used, a random move takes no time
+        :param search: not used
+        :return: the number of a column the disk can be placed in.
+        """
+        possible_moves = [column for column in range(self.game.board.width)
+                          if self.game.check_col(column) != -1]
+        if not possible_moves:
+            raise Exception('No possible AI moves')
+        self.last_found_move = self.random.choice(possible_moves)
+        return self.last_found_move
+
+    def get_last_found_move(self):
+        return self.last_found_move
+
+    def stop(self):
+        pass
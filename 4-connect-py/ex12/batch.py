@@ -0,0 +1,197 @@
+import numpy as np
+
+from .game import Board, Game, Geometry
+
+EMPTY = 0
+ONGOING = -1
+
+# (row step, column step) of the four directions a line can go in
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+class BatchGame:
+    """
+    This class plays many games at once. The boards are kept in one array
+    of shape (n, height, width) holding 0 for an empty place or the player
+    who owns it (row 0 is the top row, like in Game), and every step plays
+    one move in every game that has not ended yet using array operations.
+    :param n: the number of games
+    :param width: the number of columns of each board
+    :param height: the number of rows of each board
+    :param disks_to_win: the number of disks in a row that win a game
+    """
+
+    def __init__(self, n, width=Game.BOARD_WIDTH, height=Game.BOARD_HEIGHT,
+                 disks_to_win=Game.DISKS_TO_WIN):
+        self.n = n
+        self.width = width
+        self.height = height
+        self.disks_to_win = disks_to_win
+        self.boards = np.zeros((n, height, width), dtype=np.int8)
+        self.heights = np.zeros((n, width), dtype=np.int8)
+        self.current_player = np.full(n, Game.PLAYER_1, dtype=np.int8)
+        self.moves_played = np.zeros(n, dtype=np.int16)
+        self.winner = np.full(n, ONGOING, dtype=np.int8)
+        self.history = np.full((n, width * height), -1, dtype=np.int8)
+
+    @property
+    def active(self):
+        """
+        A boolean array marking the games that have not ended.
+        """
+        return self.winner == ONGOING
+
+    def legal_moves(self):
+        """
+        :return: a boolean array of shape (n, width), True where a disk can
+        be placed. Games that have ended have no legal moves.
+        """
+        return (self.heights < self.height) & self.active[:, None]
+
+    def make_moves(self, columns):
+        """
+        This function will place a disk in the given column of every game
+        that has not ended yet, check the lines through each new disk and
+        change the players. Columns given for games that have ended are
+        ignored.
+        :param columns: an array of n column numbers
+        :return: None
+        """
+        columns = np.asarray(columns)
+        games = np.flatnonzero(self.active)
+        if games.size == 0:
+            return
+        columns = columns[games]
+        if np.any((columns < 0) | (columns >= self.width)) or \
+                np.any(self.heights[games, columns] >= self.height):
+            raise Exception('Illegal move')
+
+        rows = self.height - 1 - self.heights[games, columns]
+        players = self.current_player[games]
+        self.boards[games, rows, columns] = players
+        self.heights[games, columns] += 1
+        self.history[games, self.moves_played[games]] = columns
+        self.moves_played[games] += 1
+
+        won = self._lines_through(games, rows, columns, players)
+        self.winner[games[won]] = players[won]
+        full = ~won & (self.moves_played[games] == self.width * self.height)
+        self.winner[games[full]] = Game.TIE
+        self.current_player[games] = 3 - players
+
+    def _lines_through(self, games, rows, columns, players):
+        """
+        This function will check, for each of the given games, the four
+        lines that go through the disk that was just placed.
+        :return: a boolean array, True for the games that were won
+        """
+        steps = np.arange(1, self.disks_to_win)
+        won = np.zeros(games.size, dtype=bool)
+        for row_step, column_step in DIRECTIONS:
+            length = np.ones(games.size, dtype=np.int16)
+            for sign in (1, -1):
+                line_rows = rows[:, None] + sign * row_step * steps
+                line_columns = columns[:, None] + sign * column_step * steps
+                inside = (line_rows >= 0) & (line_rows < self.height) & \
+                         (line_columns >= 0) & (line_columns < self.width)
+                owners = self.boards[games[:, None],
+                                     np.clip(line_rows, 0, self.height - 1),
+                                     np.clip(line_columns, 0, self.width - 1)]
+                same = inside & (owners == players[:, None])
+                # count the disks up to the first one that is not the player's
+                length += np.cumprod(same, axis=1).sum(axis=1)
+            won |= length >= self.disks_to_win
+        return won
+
+    def random_moves(self, rng):
+        """
+        :param rng: a numpy random Generator
+        :return: a random legal column for every game (0 for games that
+        have ended)
+        """
+        scores = rng.random((self.n, self.width))
+        scores[~self.legal_moves()] = -1
+        return scores.argmax(axis=1)
+
+    def play_out(self, rng):
+        """
+        This function will play random moves in all the games until every
+        one of them has ended.
+        :param rng: a numpy random Generator
+        :return: the winner array
+        """
+        while self.active.any():
+            self.make_moves(self.random_moves(rng))
+        return self.winner
+
+    def position_keys(self):
+        """
+        :return: the canonical key of every board (the same number
+        Board.canonical_key gives), as an array of n uint64
+        """
+        keys = Board.zobrist_keys(self.width, self.height)[0]
+        board = Board(self.width, self.height)
+        # the key of every (player, row, column) place, row 0 on top
+        places = np.array([[[player_keys[board.bit_index(row, column)]
+                             for column in range(self.width)]
+                            for row in range(self.height)]
+                           for player_keys in keys], dtype=np.uint64)
+        hashes = np.zeros(self.n, dtype=np.uint64)
+        mirror_hashes = np.zeros(self.n, dtype=np.uint64)
+        for player in (Game.PLAYER_1, Game.PLAYER_2):
+            owned = self.boards == player
+            place_keys = places[player - 1]
+            hashes ^= np.bitwise_xor.reduce(
+                np.where(owned, place_keys, 0), axis=(1, 2))
+            mirror_hashes ^= np.bitwise_xor.reduce(
+                np.where(owned[:, :, ::-1], place_keys, 0), axis=(1, 2))
+        return np.minimum(hashes, mirror_hashes)
+
+    def evaluate(self):
+        """
+        :return: the score of every board for the player to move (see
+        ex12.evaluate), as an array of n floats
+        """
+        from .evaluate import Evaluator
+
+        evaluator = Evaluator.get(
+            Geometry.get(self.width, self.height, self.disks_to_win))
+        first = evaluator.from_boards(self.boards, Game.PLAYER_1)
+        second = evaluator.from_boards(self.boards, Game.PLAYER_2)
+        current = np.where((self.current_player == Game.PLAYER_1)[:, None],
+                           first, second)
+        return evaluator.evaluate(current, first + second)
+
+    def to_game(self, index):
+        """
+        :param index: the number of the game in the batch
+        :return: a Game object with the same moves played
+        """
+        game = Game(self.width, self.height, self.disks_to_win)
+        for column in self.history[index, :self.moves_played[index]]:
+            game.make_move(int(column))
+        return game
+
+    @classmethod
+    def from_games(cls, games):
+        """
+        :param games: a list of Game objects, all of the same geometry
+        :return: a BatchGame where each game has the moves of the matching
+        Game object
+        """
+        geometry = games[0].geometry
+        batch = cls(len(games), geometry.width, geometry.height,
+                    geometry.disks_to_win)
+        for index, game in enumerate(games):
+            board = game.board.board
+            for row in range(batch.height):
+                for column in range(batch.width):
+                    if board[row][column] != Board.EMPTY_SLOT:
+                        batch.boards[index, row, column] = board[row][column]
+            batch.heights[index] = game.board.heights
+            batch.history[index, :len(game.history)] = game.history
+            batch.moves_played[index] = game.moves_played
+            batch.current_player[index] = game.current_player
+            winner = game.get_winner()
+            batch.winner[index] = ONGOING if winner is None else winner
+        return batch
@@ -0,0 +1,361 @@
+"""
+Benchmarks of the game engine and the AI, printed as JSON.
+
+    python -m ex12.benchmark --output before.json
+    python -m ex12.benchmark --compare before.json
+
+With --compare, every rate that got slower by more than --tolerance
+(10% by default) is listed and the exit code is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+from .ai import AI
+from .game import Game
+
+# (name, moves played from the empty board, depth)
+PERFT_POSITIONS = (
+    ('empty', '', 5),
+    ('center', '3', 5),
+    ('middlegame', '33443223', 4),
+)
+# the known number of positions of each perft, by (name, depth)
+PERFT_NODES = {
+    ('empty', 5): 16807,
+    ('empty', 4): 2401,
+    ('center', 5): 16807,
+    ('center', 4): 2401,
+    ('middlegame', 4): 2285,
+    ('middlegame', 3): 342,
+}
+AI_POSITIONS = (
+    ('empty', '', 6),
+    ('middlegame', '33443223', 6),
+)
+# (moves played from the empty board, depth) of the parallel search
+PARALLEL_POSITION = ('33', 9)
+# positions a search split over processes has to find the same score and
+# column as the search in one process for, at every depth up to SPLIT_DEPTH
+SPLIT_POSITIONS = ('', '3020', '33443223')
+SPLIT_DEPTH = 4
+PLAYOUT_GAMES = 2000
+WIN_CHECK_GAMES = 200
+
+
+def game_from_moves(moves):
+    """
+    :param moves: the columns played, as a string of digits
+    :return: a Game with the moves played
+    """
+    game = Game()
+    for column in moves:
+        game.make_move(int(column))
+    return game
+
+
+def perft(game, depth):
+    """
+    Counts the positions reached after exactly depth more moves, where a
+    game that ended has no moves after it. The moves are made and taken
+    back on the same Game.
+    :param game: the Game to start from
+    :param depth: the number of moves to go
+    :return: the number of positions
+    """
+    if depth == 0:
+        return 1
+    if game.get_winner() is not None:
+        return 0
+    nodes = 0
+    for column in range(game.board.width):
+        if game.check_col(column) != -1:
+            game.make_move(column)
+            nodes += perft(game, depth - 1)
+            game.undo_move()
+    return nodes
+
+
+def rate(function, number):
+    """
+    Runs the function number times, repeating the measure three times.
+    :return: the best number of calls per second
+    """
+    best = min(timeit.repeat(function, number=number, repeat=3))
+    return number / best
+
+
+def bench_perft(quick):
+    results = {}
+    for name, moves, depth in PERFT_POSITIONS:
+        if quick:
+            depth -= 1
+        timer = timeit.default_timer
+        start = timer()
+        nodes = perft(game_from_moves(moves), depth)
+        seconds = timer() - start
+        if nodes != PERFT_NODES[name, depth]:
+            raise Exception(f'perft {name} at depth {depth} found {nodes} '
+                            f'positions instead of {PERFT_NODES[name, depth]}')
+        results[name] = {'depth': depth, 'nodes': nodes, 'seconds': seconds,
+                         'nodes_per_second': nodes / seconds}
+    return results
+
+
+def random_games(count, seed):
+    """
+    :return: a list of the move lists of count random games
+    """
+    choose = random.Random(seed).choice
+    games = []
+    for _ in range(count):
+        game = Game()
+        while game.get_winner() is None:
+            game.make_move(choose([column
+                                   for column in range(game.board.width)
+                                   if game.check_col(column) != -1]))
+        games.append(game.history)
+    return games
+
+
+def bench_playouts(quick):
+    games = PLAYOUT_GAMES // (10 if quick else 1)
+    timer = timeit.default_timer
+    start = timer()
+    moves = sum(len(history) for history in random_games(games, 0))
+    seconds = timer() - start
+    return {'games': games, 'moves': moves, 'seconds': seconds,
+            'games_per_second': games / seconds,
+            'moves_per_second': moves / seconds}
+
+
+def bench_engine(quick):
+    """
+    Replays fixed random games move by move, and times the win checks on
+    the positions they reach: the check of the lines through the last disk
+    that a move makes (Geometry.wins and Game._update_winner, whose result
+    get_winner only reads), and the search of every place that would win
+    (Geometry.winning_places).
+    """
+    histories = random_games(WIN_CHECK_GAMES // (10 if quick else 1), 1)
+    moves = sum(len(history) for history in histories)
+
+    def replay():
+        for history in histories:
+            game = Game()
+            for column in history:
+                game.make_move(column)
+
+    finished = [game_from_moves(''.join(map(str, history)))
+                for history in histories]
+    middle = [game_from_moves(''.join(map(str, history[:len(history) // 2])))
+              for history in histories]
+    positions = finished + middle
+    geometry = positions[0].geometry
+    # the player who made the last move, and the place of that disk
+    last_moves = []
+    for game in positions:
+        player = game.current_player % 2 + 1
+        column = game.history[-1]
+        row = game.board.height - game.board.heights[column]
+        last_moves.append((game, player, row, column,
+                           game.board.bitboards[player - 1],
+                           1 << game.board.bit_index(row, column)))
+
+    def wins():
+        for _, _, _, _, bitboard, move in last_moves:
+            geometry.wins(bitboard, move)
+
+    def update_winner():
+        for game, player, row, column, _, _ in last_moves:
+            game._update_winner(player, row, column)
+
+    def winning_places():
+        for game in positions:
+            geometry.winning_places(
+                game.board.bitboards[game.current_player - 1],
+                game.board.mask)
+
+    def is_full():
+        for game in positions:
+            game.board.is_full()
+
+    return {
+        'make_move_per_second': rate(replay, 1) * moves,
+        'wins_per_second': rate(wins, 10) * len(positions),
+        'update_winner_per_second': rate(update_winner, 10) * len(positions),
+        'winning_places_per_second': rate(winning_places, 10)
+        * len(positions),
+        'is_full_per_second': rate(is_full, 10) * len(positions),
+    }
+
+
+def bench_ai(quick):
+    results = {}
+    for name, moves, depth in AI_POSITIONS:
+        game = game_from_moves(moves)
+        ai = AI(game, game.current_player, depth=depth - 1 if quick else depth)
+        move = ai.find_legal_move()
+        report = ai.report()
+        results[name] = {'depth': ai.depth, 'move': move,
+                         'nodes': report['nodes'],
+                         'seconds': report['seconds'],
+                         'nodes_per_second': report['nodes_per_second'],
+                         'table_hit_rate': report['table_hit_rate']}
+    return results
+
+
+def check_split_search(workers):
+    """
+    Searches the SPLIT_POSITIONS with and without the heuristic evaluation,
+    in one process and over the workers, and fails if the two searches
+    don't agree.
+    :return: None
+    """
+    for moves in SPLIT_POSITIONS:
+        for evaluation in (False, True):
+            game = game_from_moves(moves)
+            serial = AI(game, game.current_player, evaluation=evaluation)
+            split = AI(game, game.current_player, evaluation=evaluation,
+                       workers=workers)
+            try:
+                for depth in range(1, SPLIT_DEPTH + 1):
+                    serial.depth = split.depth = depth
+                    found = []
+                    for ai in (serial, split):
+                        move = ai.find_legal_move()
+                        found.append((ai.last_score, move))
+                    if found[0] != found[1]:
+                        raise Exception(
+                            f'the split search of {moves!r} at depth {depth} '
+                            f'(evaluation={evaluation}) found {found[1]} '
+                            f'instead of {found[0]}')
+            finally:
+                split.close()
+
+
+def bench_parallel(quick):
+    """
+    Times the same fixed depth search with 1, 2, 4... worker processes, up
+    to the number of cores (and at least 2), and how much faster each is
+    than the search in one process. Before that, the split search is
+    checked against the search in one process (see check_split_search).
+    """
+    check_split_search(2)
+    moves, depth = PARALLEL_POSITION
+    if quick:
+        depth -= 2
+    results = {}
+    workers = 1
+    single = None
+    while True:
+        game = game_from_moves(moves)
+        # a first shallow search starts the worker processes
+        ai = AI(game, game.current_player, depth=1, workers=workers)
+        ai.find_legal_move()
+        ai.depth = depth
+        timer = timeit.default_timer
+        start = timer()
+        move = ai.find_legal_move()
+        seconds = timer() - start
+        ai.close()
+        single = single or seconds
+        results[f'workers_{workers}'] = {
+            'depth': depth, 'move': move, 'seconds': seconds,
+            'speedup': single / seconds,
+            'searches_per_second': 1 / seconds}
+        if workers >= max(2, os.cpu_count() or 1):
+            return results
+        workers *= 2
+
+
+BENCHMARKS = {
+    'perft': bench_perft,
+    'playouts': bench_playouts,
+    'engine': bench_engine,
+    'ai': bench_ai,
+    'parallel': bench_parallel,
+}
+
+
+def run(names=None, quick=False):
+    """
+    :param names: the benchmarks to run, all of them if None
+    :param quick: run smaller versions of the benchmarks
+    :return: a dictionary with the results
+    """
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'quick': quick,
+        'results': {name: BENCHMARKS[name](quick)
+                    for name in names or BENCHMARKS},
+    }
+
+
+def rates(results, prefix=''):
+    """
+    :return: every rate (a '..._per_second' value) in the results, by its
+    dotted path
+    """
+    found = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            found.update(rates(value, f'{prefix}{key}.'))
+        elif key.endswith('_per_second'):
+            found[prefix + key] = value
+    return found
+
+
+def compare(baseline, results, tolerance):
+    """
+    :return: a list of (path, old rate, new rate) for the rates that got
+    slower by more than the tolerance
+    """
+    old = rates(baseline['results'])
+    new = rates(results['results'])
+    return [(path, old[path], new[path]) for path in sorted(old.keys() & new)
+            if new[path] < old[path] * (1 - tolerance)]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the game engine and the AI.')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='the benchmarks to run (all by default): '
+                             + ', '.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true',
+                        help='run smaller versions of the benchmarks')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='a results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args(args)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name!r}')
+
+    results = run(args.benchmarks, args.quick)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, results, args.tolerance)
+        for path, old, new in regressions:
+            print(f'{path}: {old:.0f} -> {new:.0f}/s '
+                  f'({(new / old - 1) * 100:+.1f}%)', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+An opening book: the best move and score of every position of the first
+moves of the game, searched ahead of time.
+
+    python -m ex12.book book.bin --plies 6 --search-depth 10
+
+The file starts with a header (the magic b'C4BK', the format version, and
+the board width, height and number of disks in a row that win), followed
+by one entry per position sorted by its canonical key (Board.canonical_key):
+the key (8 bytes), the score for the player to move (2 bytes) and the best
+column (1 byte), where the column is the one of the position the key was
+taken from (see Board.is_mirrored). The reader memory-maps the file and
+finds a position with a binary search, so looking a move up reads only a
+few pages, and processes reading the same book share them.
+"""
+import argparse
+import mmap
+import struct
+import time
+
+from .ai import AI, DEFAULT_DEPTH
+from .game import Game
+
+MAGIC = b'C4BK'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBB')
+ENTRY = struct.Struct('<QhB')
+
+
+class OpeningBook:
+    """
+    Reads an opening book file through a memory map.
+    :param path: the file to read
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.height, self.disks_to_win = \
+            HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Not an opening book file')
+        self.count = (len(self.data) - HEADER.size) // ENTRY.size
+
+    def __len__(self):
+        return self.count
+
+    def get(self, key):
+        """
+        :param key: a canonical key
+        :return: the (score, column) saved for the key, with the column in
+        the orientation of the key, or None if the key is not in the book
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, score, column = ENTRY.unpack_from(
+                self.data, HEADER.size + middle * ENTRY.size)
+            if entry_key == key:
+                return score, column
+            if entry_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def lookup(self, board):
+        """
+        :param board: a Board of the geometry of the book
+        :return: the (score, column) of the position, or None if it is not
+        in the book
+        """
+        entry = self.get(board.canonical_key())
+        if entry is None:
+            return None
+        score, column = entry
+        if board.is_mirrored():
+            column = board.width - 1 - column
+        return score, column
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_book(path, entries, width=Game.BOARD_WIDTH,
+               height=Game.BOARD_HEIGHT, disks_to_win=Game.DISKS_TO_WIN):
+    """
+    :param path: the file to write
+    :param entries: a dictionary of canonical key to (score, column)
+    :return: None
+    """
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, width, height, disks_to_win))
+        for key in sorted(entries):
+            file.write(ENTRY.pack(key, *entries[key]))
+
+
+def generate(plies, search_depth=DEFAULT_DEPTH, width=Game.BOARD_WIDTH,
+             height=Game.BOARD_HEIGHT, disks_to_win=Game.DISKS_TO_WIN):
+    """
+    This function will search every position that can be reached in up to
+    the given number of moves (a position and its mirror image once).
+    :param plies: how many moves from the start to go
+    :param search_depth: how many moves ahead to search each position
+    :return: a dictionary of canonical key to (score, column)
+    """
+    game = Game(width, height, disks_to_win)
+    # a forced move is searched too, the book needs its score
+    ai = AI(game, Game.PLAYER_1, depth=search_depth, forced_moves=False)
+    entries = {}
+
+    def visit(plies_left):
+        board = game.board
+        key = board.canonical_key()
+        if key in entries or game.get_winner() is not None:
+            return
+        ai.player = game.current_player
+        column = ai.find_legal_move()
+        if board.is_mirrored():
+            column = width - 1 - column
+        entries[key] = ai.last_score, column
+        if plies_left == 0:
+            return
+        for column in range(width):
+            if game.check_col(column) != -1:
+                game.make_move(column)
+                visit(plies_left - 1)
+                game.undo_move()
+
+    visit(plies)
+    return entries
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Search the first moves of the game into an opening '
+                    'book.')
+    parser.add_argument('output', help='the book file to write')
+    parser.add_argument('--plies', type=int, default=4,
+                        help='the number of moves from the start to cover')
+    parser.add_argument('--search-depth', type=int, default=DEFAULT_DEPTH)
+    parser.add_argument('--width', type=int, default=Game.BOARD_WIDTH)
+    parser.add_argument('--height', type=int, default=Game.BOARD_HEIGHT)
+    parser.add_argument('--connect', type=int, default=Game.DISKS_TO_WIN,
+                        help='the number of disks in a row that win')
+    args = parser.parse_args(args)
+
+    start = time.perf_counter()
+    entries = generate(args.plies, args.search_depth, args.width,
+                       args.height, args.connect)
+    write_book(args.output, entries, args.width, args.height, args.connect)
+    print(f'{len(entries)} positions in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
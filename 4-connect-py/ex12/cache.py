@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 1 << 16
+
+
+class PositionCache:
+    """
+    Remembers what is known about positions, keyed by the canonical key of
+    the board (Board.canonical_key), so a position and its mirror image
+    share an entry. One cache can be given to several AI objects, or filled
+    by batch analysis, as long as they all play the same geometry.
+
+    When the cache is full the least recently used entry is dropped. An
+    entry is only replaced by one that was searched at least as deep, so a
+    quick look at a position doesn't throw away a deeper result.
+    :param size: the most entries to keep
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, key):
+        """
+        :return: the (depth, value) saved for the key, or None if the key is
+        not in the cache
+        """
+        self.probes += 1
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, depth, value):
+        """
+        Saves the value of a position searched depth moves ahead, unless a
+        deeper result for it is already saved.
+        :return: None
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > depth:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = (depth, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        """
+        :return: the share of probes that found their position
+        """
+        return self.hits / self.probes if self.probes else 0.0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,155 @@
+"""
+A heuristic score for positions that are not decided yet, computed with
+numpy for many positions at once.
+
+For each player it counts the open lines (lines of the board the other
+player has no disk in) holding disks_to_win - 2 and disks_to_win - 1 of
+its disks, and the threats: the empty places that would complete such a
+line. A threat the player can play right now wins the game. A threat the
+player can't play yet is worth more on the rows that suit it, since with
+the board filling up it is usually the first player that gets to play on
+odd rows (counting from the bottom) and the second player on even rows.
+
+Positions are given as arrays of n x bits, one column per bit of the
+bitboard layout of Board (see Evaluator.from_bitboards and
+Evaluator.from_boards), and counting a line is a matrix product with the
+table of lines, so a batch of positions is scored in a few array
+operations.
+"""
+import numpy as np
+
+from .game import Board
+
+# the worth of an open line with disks_to_win - 2 disks, of one with
+# disks_to_win - 1 disks, and of a threat on a row that suits the player
+TWO = 1
+THREE = 4
+PARITY_THREAT = 8
+# scores are divided by this and squashed into (-1, 1), so they are always
+# worth less than a win (see AI._negamax)
+SCALE = 64
+
+
+class Evaluator:
+    """
+    Scores positions of one geometry. Building the tables goes over every
+    line, so there is one Evaluator per geometry (see Evaluator.get).
+    :param geometry: the Geometry of the board
+    """
+    _evaluators = {}
+
+    @classmethod
+    def get(cls, geometry):
+        """
+        :return: the Evaluator of the geometry, building it the first time
+        it is asked for
+        """
+        if geometry not in cls._evaluators:
+            cls._evaluators[geometry] = cls(geometry)
+        return cls._evaluators[geometry]
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        self.bits = geometry.width * geometry.stride
+        self.lines = np.zeros((len(geometry.lines), self.bits),
+                              dtype=np.float32)
+        for index, line in enumerate(geometry.lines):
+            for bit in range(self.bits):
+                if line >> bit & 1:
+                    self.lines[index, bit] = 1
+        levels = np.arange(self.bits) % geometry.stride
+        self.on_board = levels < geometry.height
+        self.bottom_level = levels == 0
+        # level 0 is the first row from the bottom, an odd row
+        self.odd_row = self.on_board & (levels % 2 == 0)
+        self.even_row = self.on_board & (levels % 2 == 1)
+        self.bytes = (self.bits + 7) // 8
+
+    def from_bitboards(self, bitboards):
+        """
+        :param bitboards: a list of bitboards (ints)
+        :return: an n x bits array of 0 and 1
+        """
+        data = b''.join(bitboard.to_bytes(self.bytes, 'little')
+                        for bitboard in bitboards)
+        array = np.unpackbits(np.frombuffer(data, dtype=np.uint8)
+                              .reshape(len(bitboards), self.bytes),
+                              axis=1, bitorder='little')
+        return array[:, :self.bits].astype(np.float32)
+
+    def from_boards(self, boards, player):
+        """
+        :param boards: an n x height x width array holding the owner of
+        every place, row 0 on top (the layout of BatchGame)
+        :param player: the player whose disks to take
+        :return: an n x bits array of 0 and 1
+        """
+        geometry = self.geometry
+        board = Board(geometry.width, geometry.height)
+        array = np.zeros((len(boards), self.bits), dtype=np.float32)
+        for row in range(geometry.height):
+            for column in range(geometry.width):
+                array[:, board.bit_index(row, column)] = \
+                    boards[:, row, column] == player
+        return array
+
+    def _side(self, own, other, empty, playable):
+        """
+        :return: the score of the open lines of one player, its threats on
+        odd and on even rows that can't be played yet, and whether it can
+        win with its next disk
+        """
+        geometry = self.geometry
+        own_counts = own @ self.lines.T
+        open_lines = (other @ self.lines.T) == 0
+        threes = open_lines & (own_counts == geometry.disks_to_win - 1)
+        score = THREE * threes.sum(axis=1)
+        if geometry.disks_to_win > 2:
+            score = score + TWO * (
+                open_lines & (own_counts == geometry.disks_to_win - 2)
+            ).sum(axis=1)
+        threats = ((threes.astype(np.float32) @ self.lines) > 0) & empty
+        waiting = threats & ~playable
+        return (score, (waiting & self.odd_row).sum(axis=1),
+                (waiting & self.even_row).sum(axis=1),
+                (threats & playable).any(axis=1))
+
+    def evaluate(self, current, mask):
+        """
+        :param current: an n x bits array of the disks of the player to
+        move
+        :param mask: an n x bits array of all the disks
+        :return: the score of every position for the player to move: the
+        score of a win (as AI._negamax gives it) if the player to move can
+        win with its next disk, 0 if the board is full, and otherwise a
+        heuristic score between -1 and 1
+        """
+        other = mask - current
+        empty = (mask == 0) & self.on_board
+        below = np.zeros_like(empty)
+        below[:, 1:] = mask[:, :-1] > 0
+        playable = empty & (below | self.bottom_level)
+        moves = mask.sum(axis=1).astype(np.int64)
+        # the player to move played first if the number of disks is even
+        first_to_move = moves % 2 == 0
+        own, own_odd, own_even, wins = self._side(current, other, empty,
+                                                  playable)
+        rival, rival_odd, rival_even, _ = self._side(other, current, empty,
+                                                     playable)
+        own = own + PARITY_THREAT * np.where(first_to_move, own_odd,
+                                             own_even)
+        rival = rival + PARITY_THREAT * np.where(first_to_move, rival_even,
+                                                 rival_odd)
+        score = np.tanh((own - rival) / SCALE)
+        win_score = (self.geometry.cells + 1 - moves) // 2
+        score = np.where(moves == self.geometry.cells, 0, score)
+        return np.where(wins, win_score, score)
+
+    def evaluate_bitboards(self, currents, masks):
+        """
+        :param currents: the bitboards of the players to move
+        :param masks: the bitboards of all the disks
+        :return: the scores (see evaluate), as a list of floats
+        """
+        return self.evaluate(self.from_bitboards(currents),
+                             self.from_bitboards(masks)).tolist()
@@ -1,4 +1,6 @@
-import numpy as np
+import random
+
+from . import metrics
 
 
 class Game:
@@ -6,6 +8,9 @@ class Game:
     This class represents the game (handles the game engine). Here the moves
     will be made by each player, check if there is a win either horizontally,
     vertically, or diagonally, or if the board if full and it's a tie.
+    :param width: the number of columns
+    :param height: the number of rows
+    :param disks_to_win: the number of disks in a row that win the game
     """
 
     DISKS_TO_WIN = 4
@@ -15,10 +20,17 @@ class Game:
     PLAYER_1 = 1
     PLAYER_2 = 2
 
-    def __init__(self):
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT,
+                 disks_to_win=DISKS_TO_WIN):
         self.current_player = 1
-        self.board = Board(self.BOARD_WIDTH, self.BOARD_HEIGHT)
-
+        self.geometry = Geometry.get(width, height, disks_to_win)
+        self.board = Board(width, height)
+        self.moves_played = 0
+        self.history = []
+        self._winner = None
+        self._winning_cells = None
+
+    @metrics.timed('game.make_move')
     def make_move(self, column):
         """
         This function will receive the number of the column we want to place
@@ -28,25 +40,77 @@ class Game:
         :param column: the column we want to add a disk to
         :return: None
         """
-        if column is None or column < 0 or column >= self.BOARD_WIDTH \
-                or self.get_winner() is not None:
+        if column is None or column < 0 or column >= self.board.width \
+                or self._winner is not None:
             raise Exception('Illegal move')
         row = self.check_col(column)
         if row == -1:
             raise Exception('Illegal move')
         self.board.make_move(self.current_player, row, column)
+        self.moves_played += 1
+        self.history.append(column)
+        self._update_winner(self.current_player, row, column)
         self.current_player = (self.current_player % 2) + 1  # change the player
 
+    def undo_move(self):
+        """
+        This function will take back the last move: remove its disk, give
+        the turn back to the player who made it and clear the winner (a
+        move can only be made before the game ended).
+        :return: the column of the move that was taken back
+        """
+        if not self.history:
+            raise Exception('No moves to undo')
+        column = self.history.pop()
+        self.board.undo_move(column)
+        self.moves_played -= 1
+        self.current_player = (self.current_player % 2) + 1
+        self._winner = None
+        self._winning_cells = None
+        return column
+
+    def copy(self):
+        """
+        :return: a new Game in the same state, that can be played on
+        without changing this one
+        """
+        game = Game.__new__(Game)
+        game.__dict__.update(self.__dict__)
+        game.board = self.board.copy()
+        game.history = self.history[:]
+        return game
+
     def check_col(self, column):
         """
         This function will check if the given column has an empty spot
         :param column: the column we want to add a disk to
         :return: the first empty row
         """
-        for row in range(self.board.height - 1, -1, -1):
-            if self.board.board[row][column] == Board.EMPTY_SLOT:
-                return row
-        return -1
+        return self.board.height - 1 - self.board.heights[column] \
+            if self.board.heights[column] < self.board.height else -1
+
+    def winning_columns(self, player):
+        """
+        :param player: the player to check, whether it is its turn or not
+        :return: the columns the player would win in by placing a disk
+        there now
+        """
+        return self.geometry.winning_moves(
+            self.board.bitboards[player - 1], self.board.mask)
+
+    def forced_column(self):
+        """
+        This function will find the column the current player has to play
+        without looking further ahead: a column that wins, or else the
+        column the other player would win in next (one of them, if there
+        are more, since the game is lost anyway).
+        :return: the column, or None if the move is not forced
+        """
+        if self._winner is not None:
+            return None
+        columns = self.winning_columns(self.current_player) \
+            or self.winning_columns(self.current_player % 2 + 1)
+        return columns[0] if columns else None
 
     def get_current_player(self):
         """
@@ -61,234 +125,262 @@ class Game:
         None will be returned, and finally, if the indexes are not valid,
         an exception will be raised.
         """
-        try:
-            if self.board.board[row][column] != Board.EMPTY_SLOT:
-                return self.board.board[row][column]
-            else:
-                return None
-        except IndexError:
+        if row < 0 or row >= self.board.height \
+                or column < 0 or column >= self.board.width:
             raise Exception("illegal location")
+        return self.board.player_at(row, column)
 
-    def _win_in_row(self, player):
+    @metrics.timed('game.win_check')
+    def _update_winner(self, player, row, column):
         """
-        This function will check if there are 4 disks, in succession, in one row
-        :param player: the current player
-        :return: True if four were found, False otherwise
-        """
-        for row_num in range(len(self.board.board)):
-            win = []
-            disks_in_row = 0
-            for column_num in range(len(self.board.board[row_num])):
-                if self.board.board[row_num][column_num] == player:
-                    win.append((row_num, column_num))
-                    disks_in_row += 1
-                else:
-                    win = []
-                    disks_in_row = 0
-
-                if disks_in_row == self.DISKS_TO_WIN:
-
-                    return True, win
-        return False, []
-
-        # disks_in_row = 0
-        # for row in self.board.board:
-        #     disks_in_row = 0
-        #     for element in row:
-        #         if element == player:
-        #             disks_in_row += 1
-        #         else:
-        #             disks_in_row = 0
-        #
-        #         if disks_in_row == self.DISKS_TO_WIN:
-        #             return True
-        #
-        # return disks_in_row == self.DISKS_TO_WIN
-
-    def _win_in_col(self, player):
-        """
-        This function will check if there are 4 disks consecutively in one
-        column
-        :param player: the current player
-        :return: True if four were found, False otherwise
-        """
-        transposed_board = np.transpose(self.board.board)
-        disks_in_row = 0
-
-        for row_num in range(len(transposed_board)):
-            win = []
-            disks_in_row = 0
-            for column_num in range(len(transposed_board[row_num])):
-                if transposed_board[row_num][column_num] == str(player):
-                    win.append((column_num, row_num))
-                    disks_in_row += 1
-                else:
-                    win = []
-                    disks_in_row = 0
-
-                if disks_in_row == self.DISKS_TO_WIN:
-
-                    return True, win
-        return False, []
-
-        # board_t = np.transpose(self.board.board)
-        # disks_in_col = 0
-        # for row in list(board_t):
-        #     disks_in_col = 0
-        #     for element in row:
-        #         if element == str(player):
-        #             disks_in_col += 1
-        #         else:
-        #             disks_in_col = 0
-        #         if disks_in_col == self.DISKS_TO_WIN:
-        #             return True
-        #
-        # return disks_in_col == self.DISKS_TO_WIN
-
-    def _win_in_diag(self, player):
-        """
-        This function will check if the are 4 disks one after the other
-        diagonally.
-        :param player: the current player
-        :return: True if four were found, False otherwise
-        """
-        board_inds = [[0, 1, 2, 3, 4, 5, 6],
-                      [7, 8, 9, 10, 11, 12, 13],
-                      [14, 15, 16, 17, 18, 19, 20],
-                      [21, 22, 23, 24, 25, 26, 27],
-                      [28, 29, 30, 31, 32, 33, 34],
-                      [35, 36, 37, 38, 39, 40, 41]]
-
-        for i in range(-2, 4):
-            win = []
-            winning_places = []
-            curr_array = np.diag(self.board.board, i)
-            ind_array = np.diag(board_inds, i)
-            disks_in_diag = 0
-
-            for ind in range(len(curr_array)):
-                if curr_array[ind] == str(player):
-                    winning_places.append(ind_array[ind])
-                    disks_in_diag += 1
-
-                    if disks_in_diag == 4:
-                        for j in winning_places:
-                            for row_num in range(len(board_inds)):
-                                for column_num in range(
-                                        len(board_inds[row_num])):
-                                    if board_inds[row_num][column_num] == j:
-                                        win.append((row_num, column_num))
-                        print('windiag')
-                        return True, win
-
-                else:
-                    winning_places = []
-                    disks_in_diag = 0
-
-            ##################################################################
-
-            win2 = []
-            winning_places2 = []
-            curr_array2 = np.diag(np.fliplr(self.board.board), i)
-            ind_array2 = np.diag(np.fliplr(board_inds), i)
-            disks_in_diag2 = 0
-
-            for ind2 in range(len(curr_array2)):
-                if curr_array2[ind2] == str(player):
-                    winning_places2.append(ind_array2[ind2])
-
-                    disks_in_diag2 += 1
-
-                    if disks_in_diag2 == 4:
-                        for j in winning_places2:
-                            for row_num in range(len(board_inds)):
-                                for column_num in range(
-                                        len(board_inds[row_num])):
-                                    if board_inds[row_num][column_num] == j:
-                                        win2.append((row_num, column_num))
-
-                        return True, win2
-
-                else:
-                    winning_places2 = []
-                    disks_in_diag2 = 0
-        return False, []
-        # for i in range(-2, 4):
-        #     disks_in_diag = 0
-        #     disks_in_diag2 = 0
-        #
-        #     curr_array = np.diag(self.board.board, i)
-        #     curr_array2 = np.diag(np.fliplr(self.board.board), i)
-        #
-        #     for element1 in curr_array:
-        #         if element1 == str(player):
-        #             disks_in_diag += 1
-        #         else:
-        #             disks_in_diag = 0
-        #         if disks_in_diag == self.DISKS_TO_WIN:
-        #             return True
-        #     for element2 in curr_array2:
-        #         if element2 == str(player):
-        #             disks_in_diag2 += 1
-        #         else:
-        #             disks_in_diag2 = 0
-        #         if disks_in_diag2 == self.DISKS_TO_WIN:
-        #             return True
-        #
-        # return disks_in_diag == self.DISKS_TO_WIN \
-        #        or disks_in_diag2 == self.DISKS_TO_WIN
+        This function will check only the winning lines that go through the
+        disk that was just placed, and save the result so that get_winner
+        and winner_indexes don't need to look at the board again.
+        :param player: the player who placed the disk
+        :param row: the row of the disk
+        :param column: the column of the disk
+        :return: None
+        """
+        move = 1 << self.board.bit_index(row, column)
+        wins = self.geometry.wins(self.board.bitboards[player - 1], move)
+        if wins:
+            self._winner = player
+            self._winning_cells = [
+                self.board.bit_to_cell(bit)
+                for bit in range(wins.bit_length()) if wins >> bit & 1]
+        elif self.moves_played == self.geometry.cells:
+            self._winner = self.TIE
 
     def get_winner(self):
         """
         This function will check if either players won.
-        :return: if there is no winner, -1 will be returned, else if there is a
-        winner, they will be returned, and, if there are no winners and the
-        board is full, 0 will be returned.
-        """
-        player1_wins = self._win_in_row(self.PLAYER_1)[0] \
-                       or self._win_in_col(self.PLAYER_1)[0] \
-                       or self._win_in_diag(self.PLAYER_1)[0]
-        player2_wins = self._win_in_row(self.PLAYER_2)[0] \
-                       or self._win_in_col(self.PLAYER_2)[0] \
-                       or self._win_in_diag(self.PLAYER_2)[0]
-
-        tie = self.board.is_full()
-        if player1_wins:
-            return self.PLAYER_1
-        elif player2_wins:
-            return self.PLAYER_2
-        else:
-            return self.TIE if tie else None
+        :return: if there is no winner, None will be returned, else if there
+        is a winner, they will be returned, and, if there are no winners and
+        the board is full, 0 will be returned.
+        """
+        return self._winner
 
     def winner_indexes(self):
-        if self._win_in_row(self.PLAYER_1)[0]:
-            win = self._win_in_row(self.PLAYER_1)[1]
-            return win
-        elif self._win_in_col(self.PLAYER_1)[0]:
-            win = self._win_in_col(self.PLAYER_1)[1]
-            return win
-        elif self._win_in_diag(self.PLAYER_1)[0]:
-            win = self._win_in_diag(self.PLAYER_1)[1]
-            return win
-
-        if self._win_in_row(self.PLAYER_2)[0]:
-            win = self._win_in_row(self.PLAYER_2)[1]
-            return win
-        elif self._win_in_col(self.PLAYER_2)[0]:
-            win = self._win_in_col(self.PLAYER_2)[1]
-            return win
-        elif self._win_in_diag(self.PLAYER_2)[0]:
-            win = self._win_in_diag(self.PLAYER_2)[1]
-            return win
+        """
+        :return: the (row, column) places of the winning line, or None if
+        no one has won.
+        """
+        return self._winning_cells
+
+
+class Geometry:
+    """
+    The size of a board and the number of disks in a row needed to win,
+    with the tables the engine and the AIs check wins with: the bitboard of
+    every line of places that wins the game, and, for every place, the
+    lines that go through it. Building the tables goes over the whole
+    board, so each geometry is built once and shared (see Geometry.get).
+    :param width: the number of columns
+    :param height: the number of rows
+    :param disks_to_win: the number of disks in a row that win the game
+    """
+    _geometries = {}
+
+    # (column step, level step) of the four directions a line can go in
+    DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+    @classmethod
+    def get(cls, width, height, disks_to_win):
+        """
+        :return: the Geometry of the given size, building it the first time
+        it is asked for
+        """
+        key = (width, height, disks_to_win)
+        if key not in cls._geometries:
+            cls._geometries[key] = cls(width, height, disks_to_win)
+        return cls._geometries[key]
+
+    def __init__(self, width, height, disks_to_win):
+        if width < 1 or height < 1 or disks_to_win < 1 \
+                or disks_to_win > max(width, height):
+            raise Exception('Illegal board size')
+        self.width = width
+        self.height = height
+        self.disks_to_win = disks_to_win
+        self.cells = width * height
+        self.stride = height + 1
+        self.bottom = [1 << column * self.stride for column in range(width)]
+        self.top = [1 << (column * self.stride + height - 1)
+                    for column in range(width)]
+
+        self.lines = []
+        cell_lines = {}
+        for column in range(width):
+            for level in range(height):
+                for column_step, level_step in self.DIRECTIONS:
+                    last_column = column + column_step * (disks_to_win - 1)
+                    last_level = level + level_step * (disks_to_win - 1)
+                    if not (0 <= last_column < width
+                            and 0 <= last_level < height):
+                        continue
+                    bits = [1 << ((column + column_step * i) * self.stride
+                                  + level + level_step * i)
+                            for i in range(disks_to_win)]
+                    line = sum(bits)
+                    self.lines.append(line)
+                    for bit in bits:
+                        cell_lines.setdefault(bit, []).append(line)
+        # keyed by the bit of the place (1 << bit index), not its index, so
+        # a move found with bitboard arithmetic can be looked up directly
+        self.cell_lines = {bit: tuple(lines)
+                           for bit, lines in cell_lines.items()}
+
+        # every place of the board, and the lowest place of every column
+        self.places = sum(((1 << height) - 1) << column * self.stride
+                          for column in range(width))
+        self.bottom_row = sum(self.bottom)
+        # for every direction and every position of the missing disk in a
+        # line, how far the other disks are from it. The bitboard is first
+        # shifted up by the largest distance, so all of them are shifts
+        # down, and the empty level on top of every column keeps lines from
+        # going around the edge of the board. Going up a column, the disk
+        # can only be missing at the top, since disks fall to the bottom
+        self.shift = (self.stride + 1) * (disks_to_win - 1)
+        self.line_shifts = []
+        for column_step, level_step in self.DIRECTIONS:
+            step = column_step * self.stride + level_step
+            for missing in range(disks_to_win):
+                if not column_step and missing != disks_to_win - 1:
+                    continue
+                self.line_shifts.append(tuple(
+                    self.shift + step * (i - missing)
+                    for i in range(disks_to_win) if i != missing))
+
+    def __reduce__(self):
+        return Geometry.get, (self.width, self.height, self.disks_to_win)
+
+    def wins(self, bitboard, move):
+        """
+        :param bitboard: the disks of a player
+        :param move: the bit of the disk the player placed last
+        :return: the union of the winning lines of bitboard that go through
+        move (0 if there are none)
+        """
+        found = 0
+        for line in self.cell_lines.get(move, ()):
+            if bitboard & line == line:
+                found |= line
+        return found
+
+    def moves(self, mask):
+        """
+        :param mask: the bitboard of all the disks
+        :return: the columns that are not full
+        """
+        return [column for column in range(self.width)
+                if not mask & self.top[column]]
+
+    def winning_places(self, bitboard, mask):
+        """
+        This function will find the places that complete a line, for all
+        the lines of the board at once, with a fixed number of shifts of
+        the bitboard whatever the position is.
+        :param bitboard: the disks of a player
+        :param mask: the bitboard of all the disks
+        :return: the bitboard of the empty places (playable now or not)
+        that would win the game for the player
+        """
+        shifted = bitboard << self.shift
+        places = 0
+        for shifts in self.line_shifts:
+            found = self.places
+            for shift in shifts:
+                found &= shifted >> shift
+            places |= found
+        return places & ~mask
+
+    def playable_places(self, mask):
+        """
+        :param mask: the bitboard of all the disks
+        :return: the bitboard of the places a disk would fall to
+        """
+        return (mask + self.bottom_row) & self.places
+
+    def winning_moves(self, bitboard, mask):
+        """
+        :param bitboard: the disks of a player
+        :param mask: the bitboard of all the disks
+        :return: the columns the player would win in with its next disk
+        """
+        places = self.winning_places(bitboard, mask) \
+            & self.playable_places(mask)
+        return [column for column in range(self.width)
+                if places >> column * self.stride
+                & ((1 << self.height) - 1)]
 
 
 class Board:
+    """
+    The board is kept as two bitboards, one per player, plus the number of
+    disks in each column. Every column takes height + 1 bits (the extra bit
+    is an always empty sentinel, so lines never wrap into the next column),
+    with the bottom cell of a column in its lowest bit.
+
+    The board also keeps a Zobrist hash of its disks (the xor of a random
+    number for every (player, place)), and the hash of its mirror image,
+    both updated with every move. The smaller of the two is the canonical
+    key, which is the same for a position and its left-right mirror, so a
+    cache keyed on it needs only one entry for both (see canonical_key).
+    """
     EMPTY_SLOT = '_'
+    _zobrist_keys = {}
+
+    @classmethod
+    def zobrist_keys(cls, width, height):
+        """
+        :return: the random numbers of every (player, bit) and of its mirror
+        place, as two lists of two lists indexed by player - 1 and bit. They
+        are seeded from the board size, so every process (and every run)
+        gets the same keys and hashes can be saved to disk.
+        """
+        size = (width, height)
+        if size not in cls._zobrist_keys:
+            generator = random.Random(f'zobrist {width}x{height}')
+            stride = height + 1
+            keys = [[0] * (width * stride) for _ in range(2)]
+            for player_keys in keys:
+                for column in range(width):
+                    for level in range(height):
+                        player_keys[column * stride + level] = \
+                            generator.getrandbits(64)
+            mirror_keys = [[0] * (width * stride) for _ in range(2)]
+            for player_keys, player_mirror_keys in zip(keys, mirror_keys):
+                for column in range(width):
+                    for level in range(height):
+                        player_mirror_keys[column * stride + level] = \
+                            player_keys[(width - 1 - column) * stride + level]
+            cls._zobrist_keys[size] = keys, mirror_keys
+        return cls._zobrist_keys[size]
 
     def __init__(self, width, height):
         self.width = width
         self.height = height
-        self.board = [[self.EMPTY_SLOT] * width for _ in range(height)]
+        self.stride = height + 1
+        self.bitboards = [0, 0]
+        self.mask = 0
+        self.heights = [0] * width
+        self.keys, self.mirror_keys = Board.zobrist_keys(width, height)
+        self.zobrist = 0
+        self.mirror_zobrist = 0
+
+    def bit_index(self, row, column):
+        """
+        :return: the bit that stands for the (row, column) place, where row 0
+        is the top row of the board.
+        """
+        return column * self.stride + self.height - 1 - row
+
+    def bit_to_cell(self, bit):
+        """
+        :return: the (row, column) place that the given bit stands for.
+        """
+        column, level = divmod(bit, self.stride)
+        return self.height - 1 - level, column
 
     def make_move(self, player, row, column):
         """
@@ -298,9 +390,84 @@ class Board:
         :param column: the column we want to place a disk at
         :return:
         """
-        if row >= self.height or row < 0 or column < 0 or column >= self.width:
+        if row >= self.height or row < 0 or column < 0 or column >= self.width \
+                or row != self.height - 1 - self.heights[column]:
             raise Exception('Illegal location')
-        self.board[row][column] = player
+        index = self.bit_index(row, column)
+        bit = 1 << index
+        self.bitboards[player - 1] |= bit
+        self.mask |= bit
+        self.heights[column] += 1
+        self.zobrist ^= self.keys[player - 1][index]
+        self.mirror_zobrist ^= self.mirror_keys[player - 1][index]
+
+    def undo_move(self, column):
+        """
+        This function will remove the top disk of the column.
+        :param column: the column to remove the disk from
+        :return: None
+        """
+        if self.heights[column] == 0:
+            raise Exception('Illegal location')
+        self.heights[column] -= 1
+        index = column * self.stride + self.heights[column]
+        player = 0 if self.bitboards[0] >> index & 1 else 1
+        self.bitboards[player] &= ~(1 << index)
+        self.mask &= ~(1 << index)
+        self.zobrist ^= self.keys[player][index]
+        self.mirror_zobrist ^= self.mirror_keys[player][index]
+
+    def canonical_key(self):
+        """
+        :return: the Zobrist hash of the position or of its mirror image,
+        whichever is smaller. The player to move is not part of it, since
+        the number of disks already tells whose turn it is.
+        """
+        return min(self.zobrist, self.mirror_zobrist)
+
+    def is_mirrored(self):
+        """
+        :return: True if canonical_key is the hash of the mirror image, so
+        columns saved with the key need to be mirrored (width - 1 - column)
+        """
+        return self.mirror_zobrist < self.zobrist
+
+    def copy(self):
+        """
+        :return: a new Board with the same disks
+        """
+        board = Board.__new__(Board)
+        board.__dict__.update(self.__dict__)
+        board.bitboards = self.bitboards[:]
+        board.heights = self.heights[:]
+        return board
+
+    def player_at(self, row, column):
+        """
+        :return: the player whose disk is at (row, column), or None if the
+        place is empty.
+        """
+        bit = 1 << self.bit_index(row, column)
+        if self.bitboards[0] & bit:
+            return 1
+        if self.bitboards[1] & bit:
+            return 2
+        return None
+
+    @property
+    def board(self):
+        """
+        The board as a list of rows (top row first) holding EMPTY_SLOT or the
+        owner of each place.
+        """
+        rows = []
+        for row in range(self.height):
+            cells = []
+            for column in range(self.width):
+                player = self.player_at(row, column)
+                cells.append(self.EMPTY_SLOT if player is None else player)
+            rows.append(cells)
+        return rows
 
     def is_full(self):
         """
@@ -308,12 +475,8 @@ class Board:
         in the board or not.
         :return: True if the board is full, False if not
         """
-        empty_cells = 0
-        for row in self.board:
-            for cell in row:
-                if cell == self.EMPTY_SLOT:
-                    empty_cells += 1
-        return empty_cells == 0
+        return sum(self.heights) == self.width * self.height
 
     def __repr__(self):
-        return '\n'.join([', '.join(row) for row in self.board])
+        return '\n'.join([', '.join(str(cell) for cell in row)
+                          for row in self.board])
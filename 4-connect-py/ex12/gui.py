@@ -1,9 +1,11 @@
 import tkinter as tk
-from PIL import Image, ImageTk
-from itertools import count
+from collections import OrderedDict
+import queue
+import threading
 import time
 from .game import Board, Game
-from .ai import AI
+from .ai import AI, SearchClock
+from . import metrics
 import os
 
 
@@ -17,18 +19,129 @@ def rel_path(file):
 	return os.path.join(os.path.dirname(__file__), file)
 
 
+_images = {}
+
+
+def load_image(file):
+	"""
+	This function will decode the image file the first time it is asked for
+	and give back the same PhotoImage every time after that, so every screen
+	(and every game after "play again") shares one copy of each image.
+	:param file: the name of the image file
+	:return: the PhotoImage
+	"""
+	if file not in _images:
+		_images[file] = tk.PhotoImage(file=rel_path(file))
+		if metrics.ENABLED:
+			metrics.count('gui.image_loads')
+	return _images[file]
+
+
 class GUI:
 	"""
 	Main gui window
+	:param startup_times: a StartupTimes to mark the startup steps on, or
+	None
 	"""
 
-	def __init__(self):
+	def __init__(self, startup_times=None):
 		self.root = tk.Tk()
 		self.root.resizable(False, False)
-		self.main_menu = MainMenu(self.root, relief=tk.GROOVE, anchor=tk.N, width=1600, height=1200)
-		self.main_menu.show(self.root)
+		if startup_times is not None:
+			startup_times.mark('window created')
+		self.main_menu = self.show_main_menu(self.root)
+		if startup_times is not None:
+			startup_times.mark('main menu built')
+			self.root.after_idle(self.report_startup, startup_times)
 		self.root.mainloop()
 
+	def report_startup(self, startup_times):
+		"""
+		Marks the first time the event loop is idle (the menu was drawn)
+		and prints the startup times.
+		:param startup_times: StartupTimes
+		:return: None
+		"""
+		startup_times.mark('main menu shown')
+		startup_times.stop()
+		startup_times.report()
+
+	@staticmethod
+	def show_main_menu(root):
+		"""
+		Shows the main menu on the window
+		:param root: tk
+		:return: the MainMenu
+		"""
+		main_menu = MainMenu(root, relief=tk.GROOVE, anchor=tk.N, width=1600, height=1200)
+		main_menu.show(root)
+		return main_menu
+
+
+class GifFrames:
+	"""
+	The frames of an animated gif, decoded one at a time when they are
+	asked for. Only the last few decoded frames are kept, so a long gif
+	doesn't have to be held in memory all at once.
+	:param path: the gif file
+	"""
+	CACHE_SIZE = 8
+
+	def __init__(self, path):
+		# PIL is only needed for the gif, so it is imported when the menu
+		# asks for it and not when the game starts
+		from PIL import Image, ImageTk
+		self.photo_image = ImageTk.PhotoImage
+		self.image = Image.open(path)
+		self.delay = self.image.info.get('duration') or 100
+		self.count = None  # found when the end of the gif is reached
+		self.cache = OrderedDict()
+
+	@property
+	def single(self):
+		"""
+		True if the gif has only one frame
+		"""
+		return not getattr(self.image, 'is_animated', False)
+
+	def next_index(self, index):
+		"""
+		:return: the number of the frame after the given one, going back to
+		the first frame after the last
+		"""
+		index += 1
+		if self.count is not None and index >= self.count:
+			return 0
+		return index
+
+	def prefetch(self, index):
+		"""
+		Decodes the frame ahead of time, if it isn't already.
+		:return: None
+		"""
+		if self.count is None or index < self.count:
+			self.get(index)
+
+	def get(self, index):
+		"""
+		:param index: the number of the frame
+		:return: the frame as a PhotoImage (the first frame if index is past
+		the end of the gif)
+		"""
+		if index in self.cache:
+			self.cache.move_to_end(index)
+			return self.cache[index]
+		try:
+			self.image.seek(index)
+		except EOFError:
+			self.count = index
+			return self.get(0)
+		frame = self.photo_image(self.image.copy())
+		self.cache[index] = frame
+		if len(self.cache) > self.CACHE_SIZE:
+			self.cache.popitem(last=False)
+		return frame
+
 
 class MainMenu(tk.Label):
 	"""
@@ -40,11 +153,11 @@ class MainMenu(tk.Label):
 		Main menu Initialization
 		:param root: tk
 		"""
-		PVP = tk.PhotoImage(file=rel_path("arcadePVP.resized.png"))
-		PVC = tk.PhotoImage(file=rel_path("arcadePVC.resized.png"))
-		CVP = tk.PhotoImage(file=rel_path("player_vs_computer.resized.png"))
-		CVC = tk.PhotoImage(file=rel_path("computer_vs_computer.resized.png"))
-		welcome = tk.PhotoImage(file=rel_path("welcome.png"))
+		PVP = load_image("arcadePVP.resized.png")
+		PVC = load_image("arcadePVC.resized.png")
+		CVP = load_image("player_vs_computer.resized.png")
+		CVC = load_image("computer_vs_computer.resized.png")
+		welcome = load_image("welcome.png")
 		self.welcome = tk.Label(root, image=welcome)
 		self.welcome.place(relx=.06, rely=0.1)
 
@@ -76,32 +189,28 @@ class MainMenu(tk.Label):
 	def load(self, im):
 		"""
 		This is a special function that helps the GUI load a gif onto the
-		main menu by loading frame by frame and transferring them to the main
-		menu label.
+		main menu. The first frame is shown right away, and every other
+		frame is decoded when the event loop is idle, just before it is
+		needed (see GifFrames). If the gif is missing, can't be opened, or
+		Pillow isn't installed, the menu is shown without it.
 		:param im: the gif
 		:return: None
 		"""
-		if isinstance(im, str):
-			im = Image.open(im)
-		self.loc = 0
-		self.frames = []
-
-		try:
-			for i in count(1):
-				self.frames.append(ImageTk.PhotoImage(im.copy()))
-				im.seek(i)
-		except EOFError:
-			pass
-
+		self.frames = None
+		if not os.path.exists(im):
+			return  # without the gif PIL doesn't have to be imported at all
 		try:
-			self.delay = im.info['duration']
-		except:
-			self.delay = 100
-
-		if len(self.frames) == 1:
-			self.config(image=self.frames[0])
-		else:
-			self.next_frame()
+			self.frames = GifFrames(im)
+			first_frame = self.frames.get(0)
+		except (ImportError, OSError, EOFError):
+			self.frames = None
+			return
+		self.loc = 0
+		self.delay = self.frames.delay
+		self.config(image=first_frame)
+		if not self.frames.single:
+			self.after_idle(self.frames.prefetch, 1)
+			self.after(self.delay, self.next_frame)
 
 	def unload(self):
 		"""
@@ -117,9 +226,13 @@ class MainMenu(tk.Label):
 		:return:
 		"""
 		if self.frames:
-			self.loc += 1
-			self.loc %= len(self.frames)
-			self.config(image=self.frames[self.loc])
+			self.loc = self.frames.next_index(self.loc)
+			frame = self.frames.get(self.loc)
+			if self.frames.count is not None and self.loc >= self.frames.count:
+				self.loc = 0  # the end of the gif was found just now
+			self.config(image=frame)
+			self.after_idle(self.frames.prefetch,
+							self.frames.next_index(self.loc))
 			self.after(self.delay, self.next_frame)
 
 	def start_game(self, root, p1_type, p2_type):
@@ -143,6 +256,16 @@ class GameScreen:
 	Handles showing the game
 	"""
 	MAKE_AI_MOVE = "first_ai_move"
+	AI_TIMEOUT = 0.5  # seconds the ai may think about a move
+	AI_PLAYER = AI  # or MCTS, anything with find_legal_move(timeout, search)
+	# where the top left place of the board is drawn and the size of a place
+	BOARD_LEFT = 133
+	BOARD_TOP = 35
+	CELL_WIDTH = 76
+	CELL_HEIGHT = 90
+	CROWN_OFFSET = 4  # centers the crown on a disk
+	POLL_DELAY = 20  # milliseconds between checks for the ai's move
+	CVC_DELAY = 100  # milliseconds between moves of computer against computer
 	def __init__(self, root, p1_type, p2_type):
 		"""
 		:param root:
@@ -156,77 +279,183 @@ class GameScreen:
 		self.root = root
 		self.game = Game()
 
-		self.current_player_imgs = []
-		canvas_image = tk.PhotoImage(file=rel_path("game_board2.png"))
+		self.disk_items = []
+		self.drawn_heights = [0] * self.game.board.width
+		self.turn_item = None
+		self.winner_item = None
+		canvas_image = load_image("game_board2.png")
 		self.canvas = tk.Canvas(root, width=800, height=600)
 		self.canvas.create_image(0, 0, image=canvas_image, anchor=tk.NW)
 		self.canvas.pack()
-		self.list_of_images = [canvas_image]
-		self.canvas.images = self.list_of_images
-
-		'''MAKE THE FIRST MOVE IF AI PLAYS FIRST'''
-		if p1_type == 'ai' and p2_type == "human":
-			self.player_1_ai = AI(self.game, 1)
-			self.make_move(self.MAKE_AI_MOVE)
 
 		self.winner = None
+		# every ai turn gets a new number, so a move that comes back after
+		# the turn was cancelled (quit or play again) is thrown away
+		self.turn_number = 0
+		# the SearchClock of the computer's search, while it thinks
+		self.thinking = None
+		self.thinking_thread = None
+		# the computer player searching on the human's time, if it is
+		self.pondering = None
+		self.player_1_ai = self.AI_PLAYER(self.game, 1) if self.ai[0] else None
+		self.player_2_ai = self.AI_PLAYER(self.game, 2) if self.ai[1] else None
+
+		if not all(self.ai):
+			self.canvas.bind('<ButtonRelease-1>', self.handle_click)
+			self.undo_button = tk.Button(text="undo", borderwidth=0, command=self.undo)
+			self.undo_button.place(relx=.02, rely=.3)
 
-		if p1_type == "ai" and p2_type == "ai":
-			self.player_1_ai = AI(self.game, 1)
-			self.player_2_ai = AI(self.game, 2)
-
-			for i in range(42):
-
-				self.root.after(100)
-				self.make_move(self.MAKE_AI_MOVE)
-				self.update_board(self.game.board)
-				self.root.update()
-				if self.winner is not None:
-					self.game_won()
-					break
-
+		'''MAKE THE FIRST MOVE IF AI PLAYS FIRST'''
+		if self.ai[0]:
+			self.make_move(self.MAKE_AI_MOVE)
 		else:
-			self.canvas.bind('<ButtonRelease-1>', self.handle_click)
-			self.player_2_ai = AI(self.game, 2)
+			self.start_pondering()
 
 	def make_move(self, col):
 		"""
-		Makes a turn
-		:param player_id: int, player number ( 1 or 2)
-		:param col:
+		Makes a turn. A human move is played right away, and if the
+		computer plays next its move is started.
+		:param col: the column, or MAKE_AI_MOVE to start the computer's move
 		:return:
 		"""
-
-		''' THIS WORKS FOR PLAYER VS AI , PLAYER VS PLAYER,AI VS AI'''
 		if col == self.MAKE_AI_MOVE:
-			if self.game.current_player == 1:
-				self.show_player_turn()
-				ai_move = self.player_1_ai.find_legal_move()
-			else:
-				self.show_player_turn()
-				ai_move = self.player_2_ai.find_legal_move()
-			try:
-				self.game.make_move(ai_move)
-			except:
-				pass
-
-			self.update_board(self.game.board)
-			self.game_won()
+			self.start_ai_turn()
 			return
 		self.show_player_turn()
 		self.game.make_move(col)
+		self.stop_pondering()
 		self.update_board(self.game.board)
+		self.game_won()
 
-		if self.ai[self.game.current_player - 1] and not self.winner:
-			self.show_player_turn()
-			current_player = self.game.current_player
-			if current_player == 1:
-				ai_move = self.player_1_ai.find_legal_move()
-			else:
-				ai_move = self.player_2_ai.find_legal_move()
-			self.game.make_move(ai_move)
+		if self.ai[self.game.current_player - 1] and self.winner is None:
+			self.start_ai_turn()
+
+	def start_ai_turn(self):
+		"""
+		This function will let the computer player whose turn it is look for
+		its move on a worker thread, and check for the result from the Tk
+		event loop, so the window keeps responding while the ai thinks.
+		:return: None
+		"""
+		self.stop_pondering()
+		if self.winner is not None:
+			return
+		ai = self.player_1_ai if self.game.current_player == 1 \
+			else self.player_2_ai
+		self.show_player_turn()
+		self.turn_number += 1
+		# made here and not on the worker thread, so a turn cancelled before
+		# the thread started its search is still stopped
+		search = self.thinking = SearchClock()
+		results = queue.Queue(maxsize=1)
+
+		def think():
+			try:
+				results.put(ai.find_legal_move(timeout=self.AI_TIMEOUT,
+											   search=search))
+			except Exception as error:
+				results.put(error)
+
+		self.thinking_thread = threading.Thread(target=think, daemon=True)
+		self.thinking_thread.start()
+		self.root.after(self.POLL_DELAY, self.finish_ai_turn, results,
+						self.turn_number)
+
+	def finish_ai_turn(self, results, turn_number):
+		"""
+		This function will play the computer's move once it was found, or
+		check again later if it wasn't. If the search failed, its error is
+		reported.
+		:param results: the queue the worker thread puts the move in
+		:param turn_number: the turn the move was asked for
+		:return: None
+		"""
+		if turn_number != self.turn_number:
+			return  # the turn was cancelled
+		try:
+			ai_move = results.get_nowait()
+		except queue.Empty:
+			self.root.after(self.POLL_DELAY, self.finish_ai_turn, results,
+							turn_number)
+			return
+		self.thinking = None
+		self.thinking_thread = None
+		if isinstance(ai_move, Exception):
+			# shown like an error raised in any other Tk callback
+			self.root.report_callback_exception(
+				type(ai_move), ai_move, ai_move.__traceback__)
+			return
+		self.game.make_move(ai_move)
+		self.update_board(self.game.board)
+		self.game_won()
+		if self.ai[self.game.current_player - 1] and self.winner is None:
+			# computer against computer: the next move after a short pause
+			self.root.after(self.CVC_DELAY, self.start_ai_turn)
+		else:
+			self.start_pondering()
+
+	def cancel_ai_turn(self):
+		"""
+		This function will stop the computer's search if it is thinking and
+		make sure its move will not be played. The worker thread is waited
+		for, so the search is over before the same ai searches again (after
+		undo).
+		:return: None
+		"""
+		self.turn_number += 1
+		if self.thinking is not None:
+			self.thinking.stop()
+			self.thinking_thread.join()
+			self.thinking = None
+			self.thinking_thread = None
+		self.stop_pondering()
+
+	def start_pondering(self):
+		"""
+		This function will let the computer player search the human's
+		possible moves while the human thinks, so it can answer the move
+		that is made right away.
+		:return: None
+		"""
+		if self.winner is not None or all(self.ai) or not any(self.ai):
+			return
+		ai = self.player_1_ai or self.player_2_ai
+		if hasattr(ai, 'ponder'):
+			ai.ponder()
+			self.pondering = ai
+
+	def stop_pondering(self):
+		"""
+		This function will stop the computer player's search on the
+		human's time, if there is one.
+		:return: None
+		"""
+		if self.pondering is not None:
+			self.pondering.stop_pondering()
+			self.pondering = None
+
+	def undo(self):
+		"""
+		This function will take back the last move of the human player,
+		together with the computer's moves that came after it, so it is a
+		human's turn again. A computer move that is being looked for is
+		cancelled.
+		:return: None
+		"""
+		if self.winner is not None:
+			return
+		self.cancel_ai_turn()
+		if self.game.history:
+			self.game.undo_move()
+			while self.ai[self.game.current_player - 1] and self.game.history:
+				self.game.undo_move()
 			self.update_board(self.game.board)
-			self.game_won()
+		# no move is about to be made, so the player to move is shown
+		self.show_player_turn(self.game.current_player)
+		if self.ai[self.game.current_player - 1]:
+			self.start_ai_turn()  # back to the computer's first move
+		else:
+			self.start_pondering()
 
 	def get_mouse(self, event):
 		"""
@@ -234,78 +463,72 @@ class GameScreen:
 		:param event: the mouse click
 		:return: the column if the click is valid or None if it's not
 		"""
-		mouse_x = event.x
-		if mouse_x < 200 and mouse_x > 120:
-			column = 0
-			if mouse_x < 110:
-				column = None
-			return column
-		if mouse_x < 290 and mouse_x > 215:
-			column = 1
-			return column
-		if mouse_x < 360 and mouse_x > 290:
-			column = 2
-			return column
-		if mouse_x < 435 and mouse_x > 360:
-			column = 3
-			return column
-		if mouse_x < 520 and mouse_x > 435:
-			column = 4
-			return column
-		if mouse_x < 585 and mouse_x > 520:
-			column = 5
-			return column
-		if mouse_x > 685:
+		column = (event.x - self.BOARD_LEFT) // self.CELL_WIDTH
+		if event.x < self.BOARD_LEFT or column >= self.game.board.width:
 			return None
-		if mouse_x < 660 and mouse_x > 585:
-			column = 6
-			return column
+		return column
 
+	def cell_position(self, row, column):
+		"""
+		:return: the canvas coordinates of the top left corner of a place
+		"""
+		return (self.BOARD_LEFT + self.CELL_WIDTH * column,
+				self.BOARD_TOP + self.CELL_HEIGHT * row)
+
+	@metrics.timed('gui.update_board')
 	def update_board(self, board: Board,if_winner = False):
 		"""
-		This function will update the board
+		This function will draw the disks that were placed since the last
+		update, and remove the ones of moves that were taken back. Every
+		disk gets one canvas item, so the canvas only grows by one item per
+		move.
 		:return: None
 		"""
-		img1 = tk.PhotoImage(file=rel_path('circle-blue.resized2.png'))
-		img2 = tk.PhotoImage(file=rel_path('circle-red.resized.png'))
-		mark_winner = tk.PhotoImage(file = rel_path('crown.png'))
-		self.list_of_images.append(img1)
-		self.list_of_images.append(img2)
-		self.list_of_images.append(mark_winner)
-		for i in range(7):  # columns
-			for j in range(6):  # rows
-
-				if board.board[j][i] == 1:
-
-					self.canvas.create_image(133 + (76*i), 35 + (90*j), image=img1, anchor=tk.NW)
-
-				elif board.board[j][i] == 2:
-					self.canvas.create_image(133 + (76*i), 35 + (90*j), image=img2, anchor=tk.NW)
-
-
-
-
-
+		if len(self.disk_items) > self.game.moves_played:
+			for item in self.disk_items[self.game.moves_played:]:
+				self.canvas.delete(item)
+			del self.disk_items[self.game.moves_played:]
+			self.drawn_heights = board.heights[:]
+		images = (load_image('circle-blue.resized2.png'),
+				  load_image('circle-red.resized.png'))
+		for move in range(len(self.disk_items), self.game.moves_played):
+			column = self.game.history[move]
+			row = board.height - 1 - self.drawn_heights[column]
+			self.drawn_heights[column] += 1
+			self.disk_items.append(self.canvas.create_image(
+				*self.cell_position(row, column), image=images[move % 2],
+				anchor=tk.NW))
+
+	def canvas_item_count(self):
+		"""
+		:return: the number of items on the canvas
+		"""
+		return len(self.canvas.find_all())
 
-	def show_player_turn(self):
+	@metrics.timed('gui.show_player_turn')
+	def show_player_turn(self, player=None):
 		"""
-		This function will show the player's image
-		:param side: 1 if left and 2 for right
-		:param player_type: 'ai' or 'human'
+		This function will show the player's image. It is called just before
+		a move is made, so by default it shows the player who moves after it.
+		:param player: the player to show (1/2), or None for the player after
+		the one whose turn it is
 		:return: None
 		"""
 
-			# self.list_of_images.pop()
 		if not self.game_won():
-			side = self.game.current_player
-			if side<2:
-				side += 1
-			else:
-				side -= 1
+			side = player
+			if side is None:
+				side = self.game.current_player
+				if side<2:
+					side += 1
+				else:
+					side -= 1
 			coords = (175,5)
-			current_turn_image = tk.PhotoImage(file=rel_path(f"player{side}turn.png"))
-			self.canvas.create_image(*coords, image=current_turn_image, anchor=tk.NW)
-			self.canvas.image = current_turn_image
+			current_turn_image = load_image(f"player{side}turn.png")
+			if self.turn_item is None:
+				self.turn_item = self.canvas.create_image(*coords, image=current_turn_image, anchor=tk.NW)
+			else:
+				self.canvas.itemconfig(self.turn_item, image=current_turn_image)
 		else:
 			self
 
@@ -317,7 +540,7 @@ class GameScreen:
 		:param column: the column the mouse clicked on
 		:return: None
 		"""
-		if self.winner is not None:
+		if self.winner is not None or self.thinking is not None:
 			return
 		if column is None:
 			column = self.get_mouse(mouse_event)
@@ -344,28 +567,44 @@ class GameScreen:
 
 
 
+	@metrics.timed('gui.show_winner')
 	def show_winner(self, winner):
 		"""
 		This function will show the winner on the screen
 		:param winner: the first player (1), the second player (2), or a tie
 		:return: None
 		"""
+		if self.winner_item is not None:
+			return  # already shown
 		if winner == 2 or winner == 1:
-			img = tk.PhotoImage(file=rel_path(f'player-{winner}-won.png'))
+			img = load_image(f'player-{winner}-won.png')
+			crown = load_image('crown.png')
+			for row, column in self.game.winner_indexes():
+				x, y = self.cell_position(row, column)
+				self.canvas.create_image(x + self.CROWN_OFFSET, y + self.CROWN_OFFSET, image=crown, anchor=tk.NW)
 		else:
-			img = tk.PhotoImage(file=rel_path('tie.png'))
-		self.list_of_images.append(img)
-		self.canvas.create_image(180, 150, image=img, anchor=tk.NW)
+			img = load_image('tie.png')
+		self.winner_item = self.canvas.create_image(180, 150, image=img, anchor=tk.NW)
 
 		button = tk.Button(text="play again", borderwidth=0, command=self.startover)
 		button.place(relx=.02, rely=.4)
-		button2 = tk.Button(text="Quit", borderwidth=0, command=quit)
+		button2 = tk.Button(text="Quit", borderwidth=0, command=self.quit)
 		button2.place(relx=.9, rely=0.4)
 
 
 	def startover(self):
 		"""
-		This function will start the game over
+		This function will start the game over, on the same window so the
+		images that were already loaded can be used again
+		"""
+		self.cancel_ai_turn()
+		for widget in self.root.winfo_children():
+			widget.destroy()
+		GUI.show_main_menu(self.root)
+
+	def quit(self):
+		"""
+		This function will stop the computer's search and quit the game
 		"""
-		self.root.destroy()
-		GUI()
+		self.cancel_ai_turn()
+		quit()
@@ -0,0 +1,156 @@
+"""
+Plays many games against an ex12.server at once and measures how it keeps
+up.
+
+    python -m ex12.loadgen --sessions 1000 --seconds 30 --player random
+
+Every client opens its own connection and plays random columns, starting a
+new game when one ends, until the time is over. The report gives the most
+sessions the server held at once, the moves per second (a client's move
+and the computer's answer count as one), and the move latency percentiles.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from .game import Game
+from .server import DEFAULT_PORT
+from .tournament import percentiles
+
+
+class LoadStats:
+    """
+    What the clients measured.
+    """
+
+    def __init__(self):
+        self.sessions = 0
+        self.most_sessions = 0
+        self.games = 0
+        self.latencies = []
+        self.errors = 0
+
+    def open_session(self):
+        self.sessions += 1
+        self.most_sessions = max(self.most_sessions, self.sessions)
+
+    def close_session(self):
+        self.sessions -= 1
+
+
+async def request(reader, writer, line):
+    """
+    :return: the words of the server's reply to the line, without the ok
+    """
+    writer.write(line.encode() + b'\n')
+    await writer.drain()
+    reply = (await reader.readline()).decode().split()
+    if not reply or reply[0] != 'ok':
+        raise Exception(' '.join(reply) or 'connection closed')
+    return reply[1:]
+
+
+async def client(connect, args, seed, end, stats):
+    """
+    Plays games on one connection until end (a time.monotonic time).
+    :return: None
+    """
+    generator = random.Random(seed)
+    reader, writer = await connect()
+    try:
+        while time.monotonic() < end:
+            session_id = (await request(reader, writer,
+                                        f'create {args.player}'))[0]
+            stats.open_session()
+            game = Game(args.width, args.height, args.connect)
+            try:
+                while game.get_winner() is None \
+                        and time.monotonic() < end:
+                    column = generator.choice(
+                        [column for column in range(game.board.width)
+                         if game.check_col(column) != -1])
+                    start = time.perf_counter()
+                    answer, _ = await request(reader, writer,
+                                              f'move {session_id} {column}')
+                    stats.latencies.append(time.perf_counter() - start)
+                    game.make_move(column)
+                    if answer != '-':
+                        game.make_move(int(answer))
+                if game.get_winner() is not None:
+                    stats.games += 1
+                await request(reader, writer, f'resign {session_id}')
+            finally:
+                stats.close_session()
+    except Exception:
+        stats.errors += 1
+    finally:
+        writer.close()
+
+
+async def run_load(args):
+    """
+    :return: a dictionary with the results
+    """
+    if args.unix:
+        def connect():
+            return asyncio.open_unix_connection(args.unix)
+    else:
+        def connect():
+            return asyncio.open_connection(args.host, args.port)
+    stats = LoadStats()
+    start = time.monotonic()
+    end = start + args.seconds
+    await asyncio.gather(*(client(connect, args, args.seed + index, end,
+                                  stats)
+                           for index in range(args.sessions)))
+    seconds = time.monotonic() - start
+    return {
+        'sessions': args.sessions,
+        'most_sessions': stats.most_sessions,
+        'games': stats.games,
+        'moves': len(stats.latencies),
+        'seconds': seconds,
+        'moves_per_second': len(stats.latencies) / seconds,
+        'move_seconds': percentiles(stats.latencies),
+        'errors': stats.errors,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Play many games against a game server at once.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help='connect to this Unix socket instead')
+    parser.add_argument('--sessions', type=int, default=100,
+                        help='the number of clients playing at once')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--player', default='random',
+                        help='the computer player to ask the server for')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--width', type=int, default=Game.BOARD_WIDTH)
+    parser.add_argument('--height', type=int, default=Game.BOARD_HEIGHT)
+    parser.add_argument('--connect', type=int, default=Game.DISKS_TO_WIN,
+                        help='the number of disks in a row that win (as the '
+                             'server was started with)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(args)
+
+    results = asyncio.run(run_load(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['most_sessions']} sessions held at once, "
+          f"{results['games']} games finished, {results['errors']} errors")
+    print(f"{results['moves']} moves in {results['seconds']:.1f}s "
+          f"({results['moves_per_second']:.0f} moves/s)")
+    print('move latency: ' + ', '.join(
+        f'{name} {seconds * 1000:.2f}ms'
+        for name, seconds in results['move_seconds'].items()))
+
+
+if __name__ == '__main__':
+    main()
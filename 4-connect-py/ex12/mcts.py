@@ -0,0 +1,398 @@
+import math
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from . import metrics
+from .ai import SearchClock
+
+DEFAULT_PLAYOUTS = 2000
+EXPLORATION = 1.4
+BATCH_SIZE = 64
+
+WIN = 1.0
+DRAW = 0.5
+LOSS = 0.0
+
+
+def playout(geometry, current, mask, moves, seed):
+    """
+    This function will play random moves from the position until the game
+    ends, except that a move that wins right away is always taken.
+    :param geometry: the Geometry of the game
+    :param current: the bitboard of the player to move
+    :param mask: the bitboard of all the disks
+    :param moves: the number of disks on the board
+    :param seed: seed for the random choices
+    :return: WIN, DRAW or LOSS for the player to move
+    """
+    choose = random.Random(seed).choice
+    result = WIN
+    while moves < geometry.cells:
+        columns = geometry.moves(mask)
+        for column in columns:
+            move = (mask + geometry.bottom[column]) & ~mask
+            if geometry.wins(current | move, move):
+                return result
+        column = choose(columns)
+        current ^= mask  # now the bitboard of the other player
+        mask |= mask + geometry.bottom[column]
+        moves += 1
+        result = WIN - result
+    return DRAW
+
+
+def playouts(geometry, positions, seed):
+    """
+    Runs a playout from each (current, mask, moves) position.
+    :return: the list of results
+    """
+    return [playout(geometry, current, mask, moves, seed + index)
+            for index, (current, mask, moves) in enumerate(positions)]
+
+
+class Node:
+    """
+    A position in the search tree. wins counts the playout results for the
+    player who made the move that led to this node.
+    """
+    __slots__ = ('move', 'parent', 'children', 'untried', 'visits', 'wins',
+                 'current', 'mask', 'moves', 'result')
+
+    def __init__(self, geometry, move, parent, current, mask, moves, result):
+        self.move = move
+        self.parent = parent
+        self.children = {}
+        self.current = current
+        self.mask = mask
+        self.moves = moves
+        self.result = result
+        self.untried = [] if result is not None else geometry.moves(mask)
+        self.visits = 0
+        self.wins = 0.0
+
+    def expand(self, geometry, column):
+        """
+        :return: the child node reached by playing the column
+        """
+        self.untried.remove(column)
+        move = (self.mask + geometry.bottom[column]) & ~self.mask
+        mask = self.mask | move
+        if geometry.wins(self.current | move, move):
+            result = LOSS  # for the player to move in the child
+        elif self.moves + 1 == geometry.cells:
+            result = DRAW
+        else:
+            result = None
+        child = Node(geometry, column, self, self.current ^ self.mask, mask,
+                     self.moves + 1, result)
+        self.children[column] = child
+        return child
+
+    def best_child(self, exploration):
+        """
+        :return: the child with the highest UCT score
+        """
+        log_visits = math.log(self.visits)
+        return max(self.children.values(), key=lambda child:
+                   child.wins / child.visits
+                   + exploration * math.sqrt(log_visits / child.visits))
+
+
+class MCTS:
+    """
+    This class represents an artificial intelligence that picks its moves
+    with Monte Carlo tree search, using UCT to choose which moves to look at
+    and (lightly guided) random playouts to score them. It has the same
+    interface as AI, so the GUI and the tournament can use either one.
+    Playouts can be run on several worker processes, in which case the tree
+    selects batches of leaves (counting them as lost until their results
+    come back, so a batch spreads over different moves) while earlier
+    batches are played out. The tree below the moves that were played is
+    kept for the next search.
+    :param game: Game object
+    :param player: current player (1/2)
+    :param playouts: the number of playouts per move when no timeout is given
+    :param workers: the number of processes running playouts
+    :param seed: seed for the random choices
+    """
+
+    def __init__(self, game, player, playouts=DEFAULT_PLAYOUTS, workers=1,
+                 seed=None, exploration=EXPLORATION):
+        self.game = game
+        self.player = player
+        self.playouts = playouts
+        self.workers = workers
+        self.exploration = exploration
+        self.random = random.Random(seed)
+        self.geometry = game.geometry
+        self.root = None
+        self.pool = None
+        self.last_found_move = None
+        # the SearchClock of the current (or last) search
+        self.search = None
+        # playouts per second of the last search or pondering, to tell how
+        # much time the playouts kept in the tree are worth
+        self.playout_rate = None
+        self.search_playouts = 0
+        self.search_time = 0.0
+        self.ponder_thread = None
+
+    def _find_root(self):
+        """
+        This function will move the root of the tree to the current
+        position of the game, keeping the subtree of the moves that were
+        played since the last search if there is one.
+        :return: None
+        """
+        board = self.game.board
+        current = board.bitboards[self.game.current_player - 1]
+        node = self.root
+        if node is not None and node.moves <= self.game.moves_played:
+            for column in self.game.history[node.moves:]:
+                node = node.children.get(column)
+                if node is None:
+                    break
+        if node is None or node.mask != board.mask or node.current != current:
+            node = Node(self.geometry, None, None, current, board.mask,
+                        self.game.moves_played, None)
+        node.parent = None
+        self.root = node
+
+    def _select(self):
+        """
+        This function will walk down the tree by UCT to a leaf, expand it,
+        and count a visit on every node of the way.
+        :return: the leaf
+        """
+        node = self.root
+        node.visits += 1
+        while node.result is None and not node.untried:
+            node = node.best_child(self.exploration)
+            node.visits += 1
+        if node.result is None:
+            node = node.expand(self.geometry,
+                               self.random.choice(node.untried))
+            node.visits += 1
+        return node
+
+    @staticmethod
+    def _backpropagate(node, result):
+        """
+        Adds the result of a playout, given for the player to move at the
+        node, to the node and all the nodes above it.
+        :return: None
+        """
+        while node is not None:
+            result = WIN - result
+            node.wins += result
+            node = node.parent
+
+    def _start_batch(self, size):
+        """
+        Selects size leaves and starts their playouts, on the worker
+        processes if there are any.
+        :return: the leaves and the results (or a future of the results)
+        """
+        leaves = [self._select() for _ in range(size)]
+        positions = [(leaf.current, leaf.mask, leaf.moves)
+                     for leaf in leaves if leaf.result is None]
+        seed = self.random.getrandbits(32)
+        if self.workers > 1:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers)
+            return leaves, self.pool.submit(playouts, self.geometry,
+                                            positions, seed)
+        return leaves, playouts(self.geometry, positions, seed)
+
+    def _finish_batch(self, leaves, results):
+        """
+        Adds the results of a batch to the tree.
+        :return: None
+        """
+        if not isinstance(results, list):
+            results = results.result()
+        results = iter(results)
+        for leaf in leaves:
+            self._backpropagate(leaf, next(results) if leaf.result is None
+                                else leaf.result)
+
+    def _most_visited(self):
+        """
+        :return: the column of the root child that was visited the most
+        """
+        return max(self.root.children.values(),
+                   key=lambda child: child.visits).move
+
+    @metrics.timed('mcts.find_legal_move')
+    def find_legal_move(self, timeout=None, search=None):
+        """
+        This function will search the current position of the game and
+        return the column that the search visited the most. The playouts
+        already in the subtree that is kept (from the last search or from
+        pondering) count towards the playouts, or, with a timeout, the time
+        they took counts towards the timeout.
+        :param timeout: the number of seconds the search may take, or None
+        to run self.playouts playouts
+        :param search: the SearchClock to stop the search with (see
+        AI.find_legal_move), or None
+        :return: the number of a column the disk can be placed in.
+        """
+        self.stop_pondering()
+        if search is None:
+            search = SearchClock()
+        self.search = search
+        if self.game.board.is_full():
+            raise Exception('No possible AI moves')
+        self._find_root()
+        forced = self.game.forced_column()
+        if forced is not None:
+            self.search_playouts = 0
+            self.search_time = 0.0
+            if metrics.ENABLED:
+                metrics.count('mcts.forced_moves')
+            self.last_found_move = forced
+            return forced
+        # with workers, keep two batches per worker going, so the tree
+        # picks the next leaves while the playouts of the last ones run
+        batch = BATCH_SIZE if self.workers > 1 else 1
+        waiting = self.workers * 2 if self.workers > 1 else 1
+        start = time.perf_counter()
+        kept = self.root.visits
+        playouts = self.playouts - kept
+        deadline = None
+        if timeout is not None:
+            if self.playout_rate:
+                timeout = max(0.0, timeout - kept / self.playout_rate)
+            deadline = start + timeout
+        pending = deque()
+        done = 0
+        while not search.stopped and (
+                done < playouts if deadline is None
+                else time.perf_counter() < deadline):
+            while len(pending) < waiting:
+                pending.append(self._start_batch(batch))
+            self._finish_batch(*pending.popleft())
+            done += batch
+            self.last_found_move = self._most_visited()
+        while pending:
+            self._finish_batch(*pending.popleft())
+        self.search_playouts = done
+        self.search_time = time.perf_counter() - start
+        if done and self.search_time:
+            self.playout_rate = done / self.search_time
+        if metrics.ENABLED:
+            metrics.observe('mcts.playouts', done)
+        if not self.root.children:
+            self._finish_batch(*self._start_batch(1))
+        self.last_found_move = self._most_visited()
+        return self.last_found_move
+
+    def ponder(self):
+        """
+        This function will start running playouts from the current
+        position on a thread, while it is the other player's turn, until
+        stop_pondering is called. The next search keeps the subtree of the
+        move that was made, with all its playouts, and needs that many
+        fewer of its own.
+        A search that was started before has to have ended first, as
+        pondering uses the same tree (see stop).
+        :return: None
+        """
+        self.stop_pondering()
+        if self.game.get_winner() is not None:
+            return
+        self._find_root()
+        self.search = SearchClock()
+        self.ponder_thread = threading.Thread(target=self._ponder,
+                                              args=(self.search,),
+                                              daemon=True)
+        self.ponder_thread.start()
+
+    def _ponder(self, search):
+        """
+        Runs playouts until the search is stopped (see ponder).
+        :param search: the SearchClock of the pondering
+        :return: None
+        """
+        batch = BATCH_SIZE if self.workers > 1 else 1
+        start = time.perf_counter()
+        done = 0
+        while not search.stopped:
+            self._finish_batch(*self._start_batch(batch))
+            done += batch
+            self.playout_rate = done / (time.perf_counter() - start)
+
+    def stop_pondering(self):
+        """
+        This function will stop pondering, if it was started, and wait for
+        the playouts to end.
+        :return: None
+        """
+        if self.ponder_thread is None:
+            return
+        self.stop()
+        self.ponder_thread.join()
+        self.ponder_thread = None
+
+    def stop(self):
+        """
+        Makes a running search end after the batch it is on. The search
+        still returns the most visited column. The search is only asked to
+        end, a thread running it should be joined before the MCTS is used
+        again. A search that might not have started yet is stopped with the
+        SearchClock it was given instead.
+        :return: None
+        """
+        if self.search is not None:
+            self.search.stop()
+
+    def get_last_found_move(self):
+        """
+        :return: the most visited column of the current (or last) search,
+        or None if nothing was found yet.
+        """
+        return self.last_found_move
+
+    def tree_size(self):
+        """
+        :return: the number of nodes in the tree and their size in bytes
+        (the nodes and their lists and dictionaries)
+        """
+        nodes = 0
+        size = 0
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            size += sys.getsizeof(node) + sys.getsizeof(node.children) \
+                + sys.getsizeof(node.untried)
+            stack.extend(node.children.values())
+        return nodes, size
+
+    def report(self):
+        """
+        :return: a dictionary with the statistics of the last search
+        """
+        nodes, size = self.tree_size()
+        return {
+            'playouts': self.search_playouts,
+            'seconds': self.search_time,
+            'playouts_per_second': self.search_playouts / self.search_time
+            if self.search_time else 0.0,
+            'workers': self.workers,
+            'tree_nodes': nodes,
+            'bytes_per_node': size / nodes if nodes else 0.0,
+        }
+
+    def close(self):
+        """
+        Stops the worker processes.
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
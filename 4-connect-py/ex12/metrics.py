@@ -0,0 +1,225 @@
+"""
+Counters and histograms of what the game spends its time on: making moves,
+checking for a win, the AI searches and drawing the game screen. They are
+off unless the FOUR_IN_A_ROW_METRICS environment variable is set, and when
+they are off the instrumented functions are not wrapped at all, so they
+cost nothing.
+
+    FOUR_IN_A_ROW_METRICS=1 python four_in_a_row.py
+    FOUR_IN_A_ROW_METRICS=metrics.json python -m ex12.tournament ai random
+
+With 1 (or any value that doesn't end with .json) the report is printed to
+stderr when the program exits; otherwise it is written to that file as
+JSON. FOUR_IN_A_ROW_METRICS_INTERVAL=10 also prints a summary every 10
+seconds. Only the process that sets the variable reports: the worker
+processes of a tournament or the server keep their own metrics and don't
+report them.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+ENABLED = bool(os.environ.get('FOUR_IN_A_ROW_METRICS'))
+# the environment variable that holds the process id of the process that
+# reports
+REPORTING_PID = 'FOUR_IN_A_ROW_METRICS_PID'
+
+PERCENTILES = (50, 90, 99)
+
+
+class Histogram:
+    """
+    Counts values in buckets that double in size, so any value is
+    remembered in a few dozen numbers. The percentiles are the top of the
+    bucket they fall in, which is at most twice the real value.
+    :param scale: what the values are multiplied by before they are put in
+    buckets (1e6 puts seconds in microsecond buckets)
+    """
+
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        bucket = int(value * self.scale).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        :return: the top of the bucket the p-th percentile falls in
+        """
+        rank = self.count * p / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(((1 << bucket) - 1) / self.scale, self.max)
+        return self.max
+
+    def summary(self):
+        """
+        :return: a dictionary with the count, the total, the mean, the
+        smallest and largest values and the percentiles
+        """
+        summary = {'count': self.count, 'total': self.total,
+                   'mean': self.total / self.count if self.count else 0,
+                   'min': self.min, 'max': self.max}
+        for p in PERCENTILES:
+            summary[f'p{p}'] = self.percentile(p) if self.count else None
+        return summary
+
+
+class Metrics:
+    """
+    The counters and histograms of the process, by name.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.start = time.perf_counter()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value, scale=1):
+        """
+        Adds a value to the histogram of the given name.
+        :return: None
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(scale)
+            histogram.add(value)
+
+    def observe_seconds(self, name, seconds):
+        self.observe(name, seconds, 1e6)
+
+    def report(self):
+        """
+        :return: a dictionary of all the counters and histogram summaries
+        """
+        with self.lock:
+            return {
+                'seconds': time.perf_counter() - self.start,
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.summary() for name, histogram
+                               in sorted(self.histograms.items())},
+            }
+
+
+_metrics = Metrics()
+
+
+def count(name, amount=1):
+    """
+    Adds to the counter of the given name.
+    :return: None
+    """
+    _metrics.count(name, amount)
+
+
+def observe(name, value):
+    """
+    Adds a value to the histogram of the given name.
+    :return: None
+    """
+    _metrics.observe(name, value)
+
+
+def observe_seconds(name, seconds):
+    """
+    Adds a duration to the histogram of the given name.
+    :return: None
+    """
+    _metrics.observe_seconds(name, seconds)
+
+
+def report():
+    """
+    :return: a dictionary of all the counters and histogram summaries
+    """
+    return _metrics.report()
+
+
+def timed(name):
+    """
+    A decorator that counts the calls of a function and keeps a histogram
+    of how long they took, under the given name. When the metrics are off
+    the function is given back as it is.
+    """
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe_seconds(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def print_report(results, file=None):
+    """
+    Prints a report as a short table.
+    :param results: a dictionary given by report()
+    :param file: where to print (stderr by default)
+    :return: None
+    """
+    file = file or sys.stderr
+    print(f"metrics: after {results['seconds']:.1f}s", file=file)
+    for name, value in sorted(results['counters'].items()):
+        print(f'metrics: {name} {value}', file=file)
+    for name, summary in results['histograms'].items():
+        print(f"metrics: {name} count {summary['count']} "
+              f"mean {summary['mean']:.6g} p50 {summary['p50']:.6g} "
+              f"p99 {summary['p99']:.6g} max {summary['max']:.6g}",
+              file=file)
+
+
+def _report_at_exit(destination):
+    if destination.endswith('.json'):
+        with open(destination, 'w') as file:
+            json.dump(report(), file, indent=2)
+    else:
+        print_report(report())
+
+
+def _report_every(seconds):
+    while True:
+        time.sleep(seconds)
+        print_report(report())
+
+
+if ENABLED:
+    # a worker process started with spawn or forkserver imports this module
+    # again (before multiprocessing knows it is a worker), but it inherits
+    # the environment, so the first process to import it marks itself there
+    if os.environ.setdefault(REPORTING_PID, str(os.getpid())) \
+            == str(os.getpid()):
+        atexit.register(_report_at_exit, os.environ['FOUR_IN_A_ROW_METRICS'])
+        _interval = os.environ.get('FOUR_IN_A_ROW_METRICS_INTERVAL')
+        if _interval:
+            threading.Thread(target=_report_every, args=(float(_interval),),
+                             daemon=True).start()
@@ -0,0 +1,267 @@
+"""
+A compact binary format for finished (or unfinished) games.
+
+A file starts with a header: the magic b'C4GR', the format version, the
+board width and height and the number of disks in a row that win. Every
+game is then stored as one byte for the result (0 for a tie, 1 or 2 for
+the winner, 255 if the game didn't end), one byte for the number of
+moves, and the columns that were played, one nibble each, two per byte
+(the high nibble first, and a 0xF nibble to fill the last byte of an odd
+number of moves). A game of n moves takes 2 + (n + 1) // 2 bytes, 13
+bytes for a random game of about 21 moves.
+
+When a writer is closed it ends the games with a 254 byte and adds an
+index: the offset of every INDEX_STRIDE-th game (8 bytes each, half a
+byte per game), the number of games, the offset of the index, the
+stride, and the magic b'C4IX'. With the index a random game takes about
+13.5 bytes, so tens of millions of games fit in a few hundred megabytes.
+The reader memory-maps the file and gets to any game by its number from
+the indexed game before it, skipping at most INDEX_STRIDE - 1 games by
+their move counts; a file without an index (a writer that was never
+closed) is scanned once instead.
+"""
+import mmap
+import struct
+from collections import namedtuple
+
+from .game import Game
+
+MAGIC = b'C4GR'
+INDEX_MAGIC = b'C4IX'
+VERSION = 2
+HEADER = struct.Struct('<4sBBBB')
+FOOTER = struct.Struct('<QQI4s')
+OFFSET = struct.Struct('<Q')
+UNFINISHED = 255
+END = 254
+PADDING = 0xF
+# the index holds the offset of one game out of this many
+INDEX_STRIDE = 16
+
+GameRecord = namedtuple('GameRecord', ['moves', 'result'])
+
+# the two moves stored in each byte value
+_NIBBLES = [(byte >> 4, byte & 0xF) for byte in range(256)]
+
+
+def encode(moves, result):
+    """
+    :param moves: the columns that were played
+    :param result: the winner (0 for a tie), or None if the game didn't end
+    :return: the game as bytes
+    """
+    if len(moves) > 255:
+        raise Exception('Too many moves for a game record')
+    data = bytearray((UNFINISHED if result is None else result, len(moves)))
+    for i in range(0, len(moves) - 1, 2):
+        data.append(moves[i] << 4 | moves[i + 1])
+    if len(moves) % 2:
+        data.append(moves[-1] << 4 | PADDING)
+    return bytes(data)
+
+
+def skip(data, offset=0):
+    """
+    :param data: bytes (or a memory map) holding a game at offset
+    :return: the offset right after the game
+    """
+    return offset + 2 + (data[offset + 1] + 1) // 2
+
+
+def decode(data, offset=0):
+    """
+    :param data: bytes (or a memory map) holding a game at offset
+    :return: the GameRecord and the offset right after it
+    """
+    result, count = data[offset], data[offset + 1]
+    end = skip(data, offset)
+    moves = []
+    for byte in data[offset + 2:end]:
+        moves.extend(_NIBBLES[byte])
+    del moves[count:]
+    return GameRecord(moves, None if result == UNFINISHED else result), end
+
+
+def replay(record, width=Game.BOARD_WIDTH, height=Game.BOARD_HEIGHT,
+           disks_to_win=Game.DISKS_TO_WIN):
+    """
+    :param record: a GameRecord
+    :return: a Game of the given geometry with the moves of the record played
+    """
+    game = Game(width, height, disks_to_win)
+    for column in record.moves:
+        game.make_move(column)
+    return game
+
+
+class GameRecordWriter:
+    """
+    Writes games to a file one at a time. Use it with a with statement, or
+    call close(), so the index is written.
+    :param path: the file to write
+    :param width: the board width (up to 15 columns fit in a nibble)
+    :param height: the board height
+    :param disks_to_win: the number of disks in a row that win
+    """
+
+    def __init__(self, path, width=Game.BOARD_WIDTH, height=Game.BOARD_HEIGHT,
+                 disks_to_win=Game.DISKS_TO_WIN):
+        if width >= PADDING:
+            raise Exception('The board is too wide for a game record')
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, width, height,
+                                    disks_to_win))
+        self.count = 0
+        # the offsets of every INDEX_STRIDE-th game
+        self.offsets = []
+
+    def write(self, game):
+        """
+        Writes the moves and the result of a Game.
+        :return: None
+        """
+        self.write_moves(game.history, game.get_winner())
+
+    def write_moves(self, moves, result):
+        """
+        Writes a game given by its columns and its result (None if it
+        didn't end).
+        :return: None
+        """
+        if not self.count % INDEX_STRIDE:
+            self.offsets.append(self.file.tell())
+        self.count += 1
+        self.file.write(encode(moves, result))
+
+    def close(self):
+        """
+        Writes the index and closes the file.
+        :return: None
+        """
+        if self.file.closed:
+            return
+        self.file.write(bytes((END,)))
+        index_offset = self.file.tell()
+        self.file.write(b''.join(OFFSET.pack(offset)
+                                 for offset in self.offsets))
+        self.file.write(FOOTER.pack(self.count, index_offset, INDEX_STRIDE,
+                                    INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameRecordReader:
+    """
+    Reads a game record file through a memory map, so only the parts that
+    are used are read from the disk, and many processes reading the same
+    file share them. Games can be read by number (reader[i]) or one after
+    the other (for record in reader).
+    :param path: the file to read
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.height, self.disks_to_win = \
+            HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Not a game record file')
+        self.end = len(self.data)
+        self.index = None
+        if len(self.data) >= HEADER.size + FOOTER.size:
+            count, index_offset, stride, index_magic = FOOTER.unpack_from(
+                self.data, len(self.data) - FOOTER.size)
+            if index_magic == INDEX_MAGIC:
+                self.end = index_offset - 1
+                self.count = count
+                self.stride = stride
+                indexed = (count + stride - 1) // stride
+                self.index = memoryview(self.data)[
+                    index_offset:index_offset + indexed * OFFSET.size
+                ].cast('Q')
+        if self.index is None:
+            offsets = [offset for offset, _ in self._scan()]
+            self.count = len(offsets)
+            self.stride = 1
+            self.index = offsets
+
+    def _scan(self):
+        """
+        Goes over the games one after the other.
+        :return: an iterator of the offset and the GameRecord of each game
+        """
+        offset = HEADER.size
+        while offset < self.end and self.data[offset] != END:
+            record, next_offset = decode(self.data, offset)
+            yield offset, record
+            offset = next_offset
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('game record index out of range')
+        offset = self.index[index // self.stride]
+        for _ in range(index % self.stride):
+            offset = skip(self.data, offset)
+        return decode(self.data, offset)[0]
+
+    def __iter__(self):
+        for _, record in self._scan():
+            yield record
+
+    def replay(self, index):
+        """
+        :return: a Game with the moves of the game with the given number
+        """
+        return replay(self[index], self.width, self.height,
+                      self.disks_to_win)
+
+    def close(self):
+        if isinstance(self.index, memoryview):
+            self.index.release()
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_records(path, chunk_size=1 << 20):
+    """
+    Reads the games of a file one after the other, a chunk at a time,
+    without a memory map or the index (for reading a file as a stream).
+    :param path: the file to read
+    :param chunk_size: how many bytes to read at a time
+    :return: an iterator of GameRecord
+    """
+    with open(path, 'rb') as file:
+        magic, version, _, _, _ = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Not a game record file')
+        buffer = b''
+        while True:
+            chunk = file.read(chunk_size)
+            buffer += chunk
+            offset = 0
+            while offset < len(buffer):
+                if buffer[offset] == END:
+                    return
+                if offset + 2 > len(buffer) \
+                        or skip(buffer, offset) > len(buffer):
+                    break  # the rest of the game is in the next chunk
+                record, offset = decode(buffer, offset)
+                yield record
+            if not chunk:
+                return
+            buffer = buffer[offset:]
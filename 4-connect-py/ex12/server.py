@@ -0,0 +1,285 @@
+"""
+Hosts many games at once for clients that connect over TCP or a Unix
+socket.
+
+    python -m ex12.server --port 4040 --workers 4
+    python -m ex12.server --unix /tmp/four-in-a-row.sock
+
+Clients send one command per line and get one reply line for each:
+
+    create [player [first]]  ->  ok <session> [<column>]
+    move <session> <column>  ->  ok <column> <result>
+    state <session>          ->  ok <current player> <result> <moves>
+    resign <session>         ->  ok
+
+create starts a game against a computer player, given as in
+ex12.tournament, or none for a game between two clients taking turns on the
+same session. Only the players the server was started with can be asked
+for (--player, ai:depth=4 and random if none are given), and the first of
+them is the default. With first, the computer makes the first move and its
+column is sent back. move plays the client's column and sends back
+the computer's answer (- if there is none) and the result of the game: -
+while it goes on, 0 for a tie, or the player who won. state sends the
+moves as columns separated by commas (- if there are none). A command that
+fails gets error <message> instead.
+
+The computer players search on a pool of worker processes, so the server
+keeps answering other sessions while they think. Sessions no client used
+for --idle seconds are removed.
+"""
+import argparse
+import asyncio
+import inspect
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .game import Game
+from .tournament import make_player, parse_variant
+
+DEFAULT_PLAYERS = ('ai:depth=4', 'random')
+DEFAULT_IDLE_SECONDS = 300
+DEFAULT_PORT = 4040
+NO_PLAYER = 'none'
+# how many connections may wait to be accepted, so thousands of clients can
+# connect at once
+BACKLOG = 4096
+
+
+def think(spec, geometry, history, seed):
+    """
+    This function will find the computer's move in a worker process. The
+    game is played again from its moves, which is much cheaper than
+    sending the game and the player between processes.
+    :return: the column the computer plays
+    """
+    game = Game(*geometry)
+    for column in history:
+        game.make_move(column)
+    player, timeout = make_player(spec, game, game.current_player, seed)
+    try:
+        return player.find_legal_move(timeout=timeout)
+    finally:
+        if hasattr(player, 'close'):
+            player.close()
+
+
+def result_text(game):
+    """
+    :return: the result of the game as it is sent to clients
+    """
+    winner = game.get_winner()
+    return '-' if winner is None else str(winner)
+
+
+class Session:
+    """
+    One game hosted by the server.
+    :param game: the Game
+    :param spec: the computer player, or None if clients play both sides
+    :param seed: the seed of the computer player
+    """
+
+    def __init__(self, game, spec, seed):
+        self.game = game
+        self.spec = spec
+        self.seed = seed
+        self.last_used = time.monotonic()
+        # a session's moves are made one at a time, even if a client sends
+        # the next move before the computer answered the last one
+        self.lock = asyncio.Lock()
+
+
+class GameServer:
+    """
+    Keeps the sessions and answers the commands of the clients.
+    :param executor: where the computer players search
+    :param players: the computer players clients may play against
+    :param idle_seconds: how long a session may go unused
+    :param geometry: the (width, height, disks_to_win) of the games
+    """
+
+    def __init__(self, executor, players=DEFAULT_PLAYERS,
+                 idle_seconds=DEFAULT_IDLE_SECONDS,
+                 geometry=(Game.BOARD_WIDTH, Game.BOARD_HEIGHT,
+                           Game.DISKS_TO_WIN)):
+        for spec in players:
+            parse_variant(spec)
+        self.executor = executor
+        self.players = players
+        self.idle_seconds = idle_seconds
+        self.geometry = geometry
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.commands = {
+            'create': self.create,
+            'move': self.move,
+            'state': self.state,
+            'resign': self.resign,
+        }
+        # the arguments are checked against these before a command runs
+        self.signatures = {name: inspect.signature(command)
+                           for name, command in self.commands.items()}
+
+    async def handle_client(self, reader, writer):
+        """
+        Answers the commands of one connection until it is closed.
+        :return: None
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode().split()
+                if not words:
+                    continue
+                command = self.commands.get(words[0])
+                try:
+                    if command is None:
+                        raise Exception(f'unknown command {words[0]}')
+                    try:
+                        self.signatures[words[0]].bind(*words[1:])
+                    except TypeError:
+                        raise Exception(f'wrong arguments for {words[0]}')
+                    reply = 'ok ' + await command(*words[1:])
+                except Exception as error:
+                    reply = f'error {error}'
+                writer.write(reply.rstrip().encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def session(self, session_id):
+        """
+        :return: the Session with the given id, marked as used now
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise Exception(f'no session {session_id}')
+        session.last_used = time.monotonic()
+        return session
+
+    async def computer_move(self, session):
+        """
+        Lets the computer player of the session play, if it is its turn.
+        :return: the column it played, or None
+        """
+        game = session.game
+        if session.spec is None or game.get_winner() is not None:
+            return None
+        column = await asyncio.get_running_loop().run_in_executor(
+            self.executor, think, session.spec, self.geometry,
+            list(game.history), session.seed + game.moves_played)
+        game.make_move(column)
+        return column
+
+    async def create(self, spec=None, first=None):
+        if first not in (None, 'first'):
+            raise Exception(f'expected first, not {first}')
+        if spec == NO_PLAYER:
+            if first:
+                raise Exception('no computer player to play first')
+            spec = None
+        elif spec is None:
+            spec = self.players[0]
+        elif spec not in self.players:
+            raise Exception(f'unknown player {spec}')
+        session_id = str(next(self.ids))
+        session = Session(Game(*self.geometry), spec, int(session_id))
+        self.sessions[session_id] = session
+        if not first:
+            return session_id
+        async with session.lock:
+            column = await self.computer_move(session)
+        return f'{session_id} {column}'
+
+    async def move(self, session_id, column):
+        session = self.session(session_id)
+        async with session.lock:
+            session.game.make_move(int(column))
+            reply = await self.computer_move(session)
+        return f'{"-" if reply is None else reply} {result_text(session.game)}'
+
+    async def state(self, session_id):
+        game = self.session(session_id).game
+        moves = ','.join(map(str, game.history)) or '-'
+        return f'{game.current_player} {result_text(game)} {moves}'
+
+    async def resign(self, session_id):
+        self.session(session_id)
+        del self.sessions[session_id]
+        return ''
+
+    async def evict_idle(self):
+        """
+        Removes the sessions that were not used for idle_seconds, checking
+        a few times in every such period.
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(self.idle_seconds / 4)
+            oldest = time.monotonic() - self.idle_seconds
+            for session_id in [session_id for session_id, session
+                               in self.sessions.items()
+                               if session.last_used < oldest]:
+                del self.sessions[session_id]
+
+
+async def serve(args):
+    with ProcessPoolExecutor(args.workers) as executor:
+        game_server = GameServer(executor, args.player or DEFAULT_PLAYERS,
+                                 args.idle,
+                                 (args.width, args.height, args.connect))
+        if args.unix:
+            server = await asyncio.start_unix_server(
+                game_server.handle_client, args.unix, backlog=BACKLOG)
+        else:
+            server = await asyncio.start_server(
+                game_server.handle_client, args.host, args.port,
+                backlog=BACKLOG)
+        evictor = asyncio.ensure_future(game_server.evict_idle())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evictor.cancel()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Host games for clients over a socket.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help='listen on this Unix socket instead')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='the number of processes the computer players '
+                             'search in')
+    parser.add_argument('--player', action='append',
+                        help='a computer player clients may ask for (the '
+                             'first one is the default), can be given more '
+                             'than once')
+    parser.add_argument('--idle', type=float, default=DEFAULT_IDLE_SECONDS,
+                        help='the seconds after which an unused session is '
+                             'removed')
+    parser.add_argument('--width', type=int, default=Game.BOARD_WIDTH)
+    parser.add_argument('--height', type=int, default=Game.BOARD_HEIGHT)
+    parser.add_argument('--connect', type=int, default=Game.DISKS_TO_WIN,
+                        help='the number of disks in a row that win')
+    args = parser.parse_args(args)
+    for spec in args.player or ():
+        try:
+            parse_variant(spec)
+        except Exception as error:
+            parser.error(str(error))
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+A database of solved positions: for every position it holds, whether the
+player to move wins, loses or draws with perfect play, in how many moves
+the game ends, and the column to play.
+
+    python -m ex12.solved solved.bin --games 1000
+
+fills the database by self-play: after a few random moves the games are
+played by an AI, which solves the positions by searching to the end of the
+game once few places are left. An AI given the database
+(AI(..., solved=...)) looks every position up before searching and saves
+every position it solves, so the database keeps growing as games are
+played.
+
+The file is a header (the magic b'C4SD', the format version, the board
+width, height and number of disks in a row that win, and the number of
+slots) followed by a fixed number of 12 byte slots, so the file never
+grows past the size it was created with. A position is kept in the slot
+of its canonical key (Board.canonical_key) modulo the number of slots, and
+when two positions need the same slot the one with more empty places,
+which takes longer to solve, is kept. A slot holds the key xored with the
+data and the data (the result, the distance, the column and the number of
+empty places), so a slot half written by another process doesn't match
+its key and is read as missing.
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+
+from .game import Game
+
+MAGIC = b'C4SD'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBBQ')
+SLOT = struct.Struct('<QI')
+DEFAULT_SLOTS = 1 << 20
+
+EMPTY = 0
+WIN = 1
+DRAW = 2
+LOSS = 3
+
+
+def from_score(score, moves, cells):
+    """
+    :param score: the exact score of a position (see AI._negamax)
+    :param moves: the number of disks on the board
+    :param cells: the number of places on the board
+    :return: the result for the player to move, and the number of moves
+    until the game ends (the winning disk included)
+    """
+    if score == 0:
+        return DRAW, cells - moves
+    # the winning disk is placed on a board of last disks, where the score
+    # is (cells + 1 - last) // 2 and last has the parity of the winner
+    winner_parity = 0 if score > 0 else 1
+    last = cells + 1 - 2 * abs(score)
+    if (last - moves) % 2 != winner_parity:
+        last -= 1
+    return (WIN if score > 0 else LOSS), last - moves + 1
+
+
+def to_score(result, distance, moves, cells):
+    """
+    :return: the score (see AI._negamax) of a result found by from_score
+    """
+    if result == DRAW:
+        return 0
+    score = (cells + 1 - (moves + distance - 1)) // 2
+    return score if result == WIN else -score
+
+
+class SolvedDatabase:
+    """
+    The solved positions saved in a file, read and written through a
+    memory map. The file is created with the given number of slots if it
+    doesn't exist.
+    :param path: the database file
+    :param slots: the number of positions a new file has room for
+    """
+
+    def __init__(self, path, slots=DEFAULT_SLOTS, width=Game.BOARD_WIDTH,
+                 height=Game.BOARD_HEIGHT, disks_to_win=Game.DISKS_TO_WIN):
+        if width * height > 0xFF:
+            raise Exception('The board is too big for a solved position '
+                            'database')
+        if not os.path.exists(path):
+            with open(path, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, VERSION, width, height,
+                                       disks_to_win, slots))
+                file.truncate(HEADER.size + slots * SLOT.size)
+        with open(path, 'r+b') as file:
+            self.data = mmap.mmap(file.fileno(), 0)
+        magic, version, self.width, self.height, self.disks_to_win, \
+            self.slots = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION \
+                or len(self.data) != HEADER.size + self.slots * SLOT.size:
+            raise Exception('Not a solved position database')
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, key):
+        """
+        :param key: a canonical key
+        :return: the (result, distance, column) saved for the key, with the
+        column in the orientation of the key, or None if the key is not in
+        the database
+        """
+        self.probes += 1
+        check, data = SLOT.unpack_from(
+            self.data, HEADER.size + key % self.slots * SLOT.size)
+        if data & 0xFF == EMPTY or check ^ data != key:
+            return None
+        self.hits += 1
+        return data & 0xFF, data >> 8 & 0xFF, data >> 16 & 0xFF
+
+    def put(self, key, result, distance, column, empty):
+        """
+        Saves a solved position, unless its slot holds another position
+        with more empty places.
+        :param empty: the number of empty places of the position
+        :return: None
+        """
+        offset = HEADER.size + key % self.slots * SLOT.size
+        check, data = SLOT.unpack_from(self.data, offset)
+        if data & 0xFF != EMPTY and check ^ data != key \
+                and data >> 24 > empty:
+            return
+        data = result | distance << 8 | column << 16 | empty << 24
+        SLOT.pack_into(self.data, offset, key ^ data, data)
+
+    def lookup(self, board):
+        """
+        :param board: a Board of the geometry of the database
+        :return: the (result, distance, column) of the position, or None if
+        it was not solved
+        """
+        entry = self.get(board.canonical_key())
+        if entry is None:
+            return None
+        result, distance, column = entry
+        if board.is_mirrored():
+            column = board.width - 1 - column
+        return result, distance, column
+
+    def save(self, board, result, distance, column):
+        """
+        Saves a solved position of the board.
+        :return: None
+        """
+        if board.is_mirrored():
+            column = board.width - 1 - column
+        self.put(board.canonical_key(), result, distance, column,
+                 board.width * board.height - sum(board.heights))
+
+    def count(self):
+        """
+        :return: the number of slots in use (this reads the whole file)
+        """
+        return sum(1 for _, data in SLOT.iter_unpack(self.data[HEADER.size:])
+                   if data & 0xFF != EMPTY)
+
+    def hit_rate(self):
+        """
+        :return: the share of probes that found their position
+        """
+        return self.hits / self.probes if self.probes else 0.0
+
+    def flush(self):
+        self.data.flush()
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def self_play(database, games, endgame_cells, opening_moves=6, depth=4,
+              seed=0):
+    """
+    This function will fill the database: every game starts with a few
+    random moves, so the games are different, and goes on with an AI that
+    searches depth moves ahead, and solves every position until the end
+    once endgame_cells places are left.
+    :return: None
+    """
+    from .ai import AI
+
+    generator = random.Random(seed)
+    for _ in range(games):
+        game = Game(database.width, database.height, database.disks_to_win)
+        while game.get_winner() is None and game.moves_played < opening_moves:
+            game.make_move(generator.choice(
+                [column for column in range(game.board.width)
+                 if game.check_col(column) != -1]))
+        ai = AI(game, game.current_player, depth, solved=database,
+                endgame_cells=endgame_cells)
+        while game.get_winner() is None:
+            ai.player = game.current_player
+            game.make_move(ai.find_legal_move())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Fill a solved position database by self-play.')
+    parser.add_argument('database', help='the database file')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--endgame', type=int, default=14,
+                        help='the number of empty places to solve from')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='how many moves ahead to search before the '
+                             'endgame')
+    parser.add_argument('--slots', type=int, default=DEFAULT_SLOTS,
+                        help='the number of positions a new database holds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--width', type=int, default=Game.BOARD_WIDTH)
+    parser.add_argument('--height', type=int, default=Game.BOARD_HEIGHT)
+    parser.add_argument('--connect', type=int, default=Game.DISKS_TO_WIN,
+                        help='the number of disks in a row that win')
+    args = parser.parse_args(args)
+
+    start = time.perf_counter()
+    with SolvedDatabase(args.database, args.slots, args.width, args.height,
+                        args.connect) as database:
+        count = database.count()
+        self_play(database, args.games, args.endgame, depth=args.depth,
+                  seed=args.seed)
+        database.flush()
+        new_count = database.count()
+        print(f'{new_count - count} positions added in '
+              f'{time.perf_counter() - start:.1f}s, '
+              f'{new_count} of {database.slots} slots used, '
+              f'{database.hit_rate():.0%} of the lookups found')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import sys
+import time
+from importlib.abc import MetaPathFinder
+
+
+class _TimedLoader:
+    """
+    Wraps the loader of a module to time how long running the module takes.
+    Anything else is passed on to the real loader.
+    """
+
+    def __init__(self, loader, name, times):
+        self._loader = loader
+        self._name = name
+        self._times = times
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        times = self._times
+        times.stack.append(0.0)  # time spent in the imports it makes
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - start
+            inner = times.stack.pop()
+            if times.stack:
+                times.stack[-1] += cumulative
+            times.imports.append((len(times.stack), self._name,
+                                  cumulative - inner, cumulative))
+
+
+class _TimedFinder(MetaPathFinder):
+    """
+    Finds modules with the other finders and times their loading.
+    """
+
+    def __init__(self, times):
+        self._times = times
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None \
+                        and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, name, self._times)
+                return spec
+        return None
+
+
+class StartupTimes:
+    """
+    Measures where the time goes from starting the program until the first
+    window is shown: every module imported after start() (with its own and
+    cumulative time, like python -X importtime), and the steps marked with
+    mark().
+    """
+
+    def __init__(self):
+        self.imports = []
+        self.stack = []
+        self.marks = []
+        self._finder = _TimedFinder(self)
+        self._start = None
+
+    def start(self):
+        """
+        Starts timing imports and steps.
+        :return: None
+        """
+        self._start = time.perf_counter()
+        sys.meta_path.insert(0, self._finder)
+
+    def stop(self):
+        """
+        Stops timing imports.
+        :return: None
+        """
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+
+    def mark(self, step):
+        """
+        Saves the time since start() at which a step was reached.
+        :param step: the name of the step
+        :return: None
+        """
+        self.marks.append((step, time.perf_counter() - self._start))
+
+    def report(self, file=None):
+        """
+        Prints the imports and the steps.
+        :param file: where to print (stderr by default)
+        :return: None
+        """
+        file = file or sys.stderr
+        print('startup: self [us] | cumulative | imported module', file=file)
+        for depth, name, own, cumulative in self.imports:
+            print(f'startup: {own * 1e6:9.0f} | {cumulative * 1e6:10.0f} | '
+                  f'{"  " * depth}{name}', file=file)
+        for step, seconds in self.marks:
+            print(f'startup: {step} at {seconds * 1000:.1f}ms', file=file)
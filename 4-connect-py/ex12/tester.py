@@ -46,6 +46,7 @@ def merge_two_lists(list1,list2):
 			list1_i += 1
 		else:
 			output.append(list2[list2_i])
+			list2_i += 1
 	if list1_i < len(list1):
 		output = output + list1[list1_i:]
 	if list2_i < len(list2):
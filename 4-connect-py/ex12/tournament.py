@@ -0,0 +1,261 @@
+"""
+Plays many games between two computer players without a window.
+
+    python -m ex12.tournament ai:depth=6 random --games 200 --workers 4
+
+A player is given as name[:option=value,...], for example ai:depth=4,
+ai:timeout=0.05, mcts:playouts=500 or random. ai:cache=65536 gives the
+player a position cache of that many entries, kept for all the games a
+worker plays with that spec, ai:book=book.bin an opening book (see
+ex12.book) and ai:solved=solved.bin a solved position database that it
+reads from and adds to (see ex12.solved). Every game starts with
+--opening random moves, and every opening is played twice, once with each
+player moving first, so players that always answer a position the same
+way (like ai) still play different games. The random choices of every
+game are seeded from --seed and the game number, so the same command
+gives the same results (as long as no timeout is used, since a timed
+search depends on the machine). The results count how many of the games
+were different.
+"""
+import argparse
+import inspect
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .ai import AI, RandomAI
+from .book import OpeningBook
+from .cache import PositionCache
+from .game import Game
+from .mcts import MCTS
+from .solved import SolvedDatabase
+
+PLAYERS = {
+    'ai': AI,
+    'mcts': MCTS,
+    'random': RandomAI,
+}
+
+PERCENTILES = (50, 90, 99)
+# the number of random moves every game starts with
+OPENING_MOVES = 4
+
+# the position caches of the worker process, by player spec
+_caches = {}
+# the opening books and solved position databases the worker process has
+# opened, by path
+_books = {}
+_databases = {}
+
+
+def parse_value(value):
+    """
+    :return: the value as an int or a float if it looks like one
+    """
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_variant(spec):
+    """
+    :param spec: a player given as name[:option=value,...]
+    :return: the name and a dictionary of the options
+    """
+    name, _, options = spec.partition(':')
+    if name not in PLAYERS:
+        raise Exception(f'Unknown player {name!r}, expected one of '
+                        f'{", ".join(PLAYERS)}')
+    kwargs = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        kwargs[key] = parse_value(value)
+    return name, kwargs
+
+
+def make_player(spec, game, player, seed):
+    """
+    :return: the player object described by spec and the timeout to give
+    it for each move
+    """
+    name, kwargs = parse_variant(spec)
+    timeout = kwargs.pop('timeout', None)
+    if 'cache' in kwargs:
+        if spec not in _caches:
+            _caches[spec] = PositionCache(kwargs['cache'])
+        kwargs['cache'] = _caches[spec]
+    if 'book' in kwargs:
+        path = kwargs['book']
+        if path not in _books:
+            _books[path] = OpeningBook(path)
+        kwargs['book'] = _books[path]
+    if 'solved' in kwargs:
+        path = kwargs['solved']
+        if path not in _databases:
+            _databases[path] = SolvedDatabase(path)
+        kwargs['solved'] = _databases[path]
+    player_class = PLAYERS[name]
+    if 'seed' in inspect.signature(player_class).parameters:
+        kwargs.setdefault('seed', seed)
+    return player_class(game, player, **kwargs), timeout
+
+
+def play_game(specs, index, seed, geometry, opening_moves=OPENING_MOVES):
+    """
+    This function will play one game. The first spec plays first in even
+    games and second in odd ones, and every even game and the odd game
+    after it start with the same random opening moves.
+    :param specs: the two players
+    :param index: the number of the game
+    :param seed: the seed of the tournament
+    :param geometry: the (width, height, disks_to_win) of the board
+    :param opening_moves: the number of random moves to start with
+    :return: the spec number that won (or None for a tie), the number of
+    moves, the seconds each move took, per spec, and the columns played
+    """
+    game = Game(*geometry)
+    generator = random.Random(seed + index // 2)
+    while game.get_winner() is None and game.moves_played < opening_moves:
+        game.make_move(generator.choice(
+            [column for column in range(game.board.width)
+             if game.check_col(column) != -1]))
+    first = index % 2
+    seats = {Game.PLAYER_1: first, Game.PLAYER_2: 1 - first}
+    players = {}
+    for player, spec_index in seats.items():
+        players[player] = make_player(specs[spec_index], game, player,
+                                      seed + index * 2 + spec_index)
+    latencies = ([], [])
+    while game.get_winner() is None:
+        ai, timeout = players[game.current_player]
+        start = time.perf_counter()
+        column = ai.find_legal_move(timeout=timeout)
+        latencies[seats[game.current_player]].append(
+            time.perf_counter() - start)
+        game.make_move(column)
+    for ai, _ in players.values():
+        if hasattr(ai, 'close'):
+            ai.close()
+    winner = game.get_winner()
+    return (None if winner == Game.TIE else seats[winner],
+            game.moves_played, latencies, tuple(game.history))
+
+
+def percentiles(values):
+    """
+    :return: a dictionary of the PERCENTILES of the values (nearest rank)
+    """
+    values = sorted(values)
+    if not values:
+        return {}
+    return {f'p{p}': values[min(len(values) - 1, len(values) * p // 100)]
+            for p in PERCENTILES}
+
+
+def run_tournament(specs, games, workers=1, seed=0,
+                   geometry=(Game.BOARD_WIDTH, Game.BOARD_HEIGHT,
+                             Game.DISKS_TO_WIN),
+                   opening_moves=OPENING_MOVES):
+    """
+    This function will play the given number of games between the two
+    players on a pool of worker processes.
+    :param specs: the two players, as name[:option=value,...]
+    :param games: the number of games to play
+    :param workers: the number of processes (1 plays in this process)
+    :param seed: the seed of the tournament
+    :param geometry: the (width, height, disks_to_win) of the board
+    :param opening_moves: the number of random moves every game starts with
+    :return: a dictionary with the results
+    """
+    for spec in specs:
+        parse_variant(spec)  # fail before starting the workers
+    start = time.perf_counter()
+    jobs = ([specs] * games, range(games), [seed] * games,
+            [geometry] * games, [opening_moves] * games)
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(play_game, *jobs,
+                                    chunksize=max(1, games // (workers * 4))))
+    else:
+        results = list(map(play_game, *jobs))
+    seconds = time.perf_counter() - start
+
+    wins = [0, 0]
+    draws = 0
+    moves = 0
+    latencies = ([], [])
+    histories = set()
+    for winner, game_moves, game_latencies, history in results:
+        if winner is None:
+            draws += 1
+        else:
+            wins[winner] += 1
+        moves += game_moves
+        histories.add(history)
+        for spec_index in range(2):
+            latencies[spec_index].extend(game_latencies[spec_index])
+    return {
+        'players': list(specs),
+        'geometry': list(geometry),
+        'games': games,
+        'distinct_games': len(histories),
+        'opening_moves': opening_moves,
+        'wins': wins[0],
+        'losses': wins[1],
+        'draws': draws,
+        'seconds': seconds,
+        'games_per_second': games / seconds if seconds else 0.0,
+        'average_moves': moves / games if games else 0.0,
+        'move_seconds': [percentiles(values) for values in latencies],
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Play games between two computer players.')
+    parser.add_argument('players', nargs=2,
+                        help='the two players, as name[:option=value,...]')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--opening', type=int, default=OPENING_MOVES,
+                        help='the number of random moves every game starts '
+                             'with')
+    parser.add_argument('--width', type=int, default=Game.BOARD_WIDTH)
+    parser.add_argument('--height', type=int, default=Game.BOARD_HEIGHT)
+    parser.add_argument('--connect', type=int, default=Game.DISKS_TO_WIN,
+                        help='the number of disks in a row that win')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(args)
+    for spec in args.players:
+        try:
+            parse_variant(spec)
+        except Exception as error:
+            parser.error(str(error))
+
+    results = run_tournament(args.players, args.games, args.workers, args.seed,
+                             (args.width, args.height, args.connect),
+                             args.opening)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['players'][0]} vs {results['players'][1]}: "
+          f"{results['wins']} wins, {results['losses']} losses, "
+          f"{results['draws']} draws")
+    print(f"{results['games']} games ({results['distinct_games']} different) "
+          f"in {results['seconds']:.2f}s "
+          f"({results['games_per_second']:.1f} games/s, "
+          f"{results['average_moves']:.1f} moves per game)")
+    for spec, move_seconds in zip(results['players'], results['move_seconds']):
+        print(f'{spec} move latency: ' + ', '.join(
+            f'{name} {seconds * 1000:.2f}ms'
+            for name, seconds in move_seconds.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,17 @@
-from ex12.gui import GUI
-
-if __name__ == '__main__':
-    gui = GUI()
+import os
+import sys
+
+if __name__ == '__main__':
+    # python four_in_a_row.py --startup-times (or FOUR_IN_A_ROW_STARTUP_TIMES=1)
+    # prints how long each import and startup step took
+    startup_times = None
+    if '--startup-times' in sys.argv[1:] \
+            or os.environ.get('FOUR_IN_A_ROW_STARTUP_TIMES'):
+        from ex12.startup import StartupTimes
+        startup_times = StartupTimes()
+        startup_times.start()
+
+    from ex12.gui import GUI
+    if startup_times is not None:
+        startup_times.mark('modules imported')
+    gui = GUI(startup_times)